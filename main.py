@@ -1,11 +1,25 @@
 import os
 import json
+import gzip
+import signal
+import struct
+import sys
+import sqlite3
+import tempfile
+import uuid
 import discord
 import datetime as dt
 import asyncio
+import bisect
+import hashlib
+import heapq
+import time
+import unicodedata
+from array import array
 from discord.ext import commands, tasks
 from discord import app_commands
-from typing import Dict, List, Tuple, Optional, Any, Set
+from typing import Callable, Dict, List, Tuple, Optional, Any, Set
+import numpy as np
 
 # --- Configurações ---
 # --- Configurações ---
@@ -60,6 +74,62 @@ HORAS_ARQUIVO = "horas_trabalho.json"
 CONFIG_FILE = "configuracoes_bot.json"
 BACKUP_DIR = "backups"
 
+# Backup compactado a cada N minutos ou M mutações (o que vier primeiro)
+BACKUP_INTERVALO_MINUTOS = 30
+BACKUP_MUTACOES = 500
+# Intervalo mínimo (segundos) entre backups automáticos, mesmo com muitas mutações (ex.: /backfill)
+BACKUP_INTERVALO_MINIMO_SEGUNDOS = 60
+# Retenção: último backup de cada hora/dia/semana dentro destas janelas
+RETENCAO_HORAS = 24
+RETENCAO_DIAS = 7
+RETENCAO_SEMANAS = 8
+
+# Backend de armazenamento das horas: "json" (padrão) ou "sqlite"
+HORAS_BACKEND = os.getenv("HORAS_BACKEND", "json").lower()
+HORAS_DB = os.getenv("HORAS_DB", "ponto.db")
+# Snapshot binário opcional (<arquivo>.bin) ao lado do JSON, para carga a frio mais rápida
+HORAS_SNAPSHOT_BINARIO = os.getenv("HORAS_SNAPSHOT_BINARIO", "0") == "1"
+
+# Máximo de canais lidos em paralelo por processar_categoria
+CANAIS_CONCORRENTES = int(os.getenv("CANAIS_CONCORRENTES", "5"))
+
+# Janela (segundos) em que mutações enfileiradas são agrupadas em um único commit
+JANELA_GROUP_COMMIT = 0.05
+
+# Mensagens lidas por lote (commit + checkpoint) no backfill do histórico completo
+TAMANHO_LOTE_BACKFILL = 500
+
+# Uma ingestão concluída há menos que isso (segundos) é reaproveitada em vez de repetida
+FRESCOR_INGESTAO = 30
+
+# Tempo máximo de uma atualização por servidor (segundos) antes de ser cancelada
+TIMEOUT_AUTO_UPDATE = 240
+TIMEOUT_LEADERBOARD_UPDATE = 600
+
+# Tamanho do journal de mutações que dispara a compactação em um novo snapshot
+LIMITE_JOURNAL_BYTES = 256 * 1024
+# Intervalo máximo (segundos) entre a última mutação e a gravação do snapshot (write-behind)
+INTERVALO_FLUSH_SEGUNDOS = 60
+
+# Modo enxuto do gateway: intents mínimos, sem cache de membros nem chunking na conexão
+BOT_MODO_ENXUTO = os.getenv("BOT_MODO_ENXUTO", "0") == "1"
+# Mensagens mantidas no cache do discord.py no modo enxuto (edições/remoções usam os eventos raw)
+MAX_MENSAGENS_CACHE = int(os.getenv("MAX_MENSAGENS_CACHE", "100"))
+
+# Validade (segundos) do plano de reset gerado pela prévia do /arquivados
+VALIDADE_PLANO_ARQUIVADOS = 5 * 60
+
+# Validade (segundos) de um nome de exibição no cache antes de ser consultado de novo.
+# No modo enxuto o discord.py descarta GUILD_MEMBER_UPDATE de membros fora do cache (on_member_update
+# e on_user_update não disparam), então mudanças de apelido só chegam pela reconsulta: validade menor.
+TTL_NOMES_MEMBROS = 30 * 60 if BOT_MODO_ENXUTO else 6 * 60 * 60
+# Máximo de IDs por consulta de membros no gateway (limite do Discord)
+LOTE_CONSULTA_MEMBROS = 100
+# Apelidos novos até este número são buscados um a um (query_members); acima, o servidor inteiro é listado
+LIMITE_CONSULTAS_APELIDOS = 10
+# Dias até um apelido sem membro correspondente ser procurado de novo
+DIAS_NOVA_TENTATIVA_APELIDOS = 30
+
 NYOX_BOT_NAMES = ["Nyox Bate-Ponto", "Nyox Store", "NYOX", "Bate-Ponto"]
 CARGO_CONSULTA_ID = [1420037335042625678, 1364716267495227494]
 
@@ -81,65 +151,1423 @@ def verificar_servidor_permitido():
         return True
     return app_commands.check(predicate)
 
-# --- Funções utilitárias ---
-def carregar_horas(guild_id: int = None) -> Dict[str, Any]:
-    """Carrega os dados de horas do arquivo JSON específico do servidor"""
-    try:
-        # Determinar qual arquivo usar baseado no servidor
-        if guild_id:
-            server_config = get_server_config(guild_id)
-            arquivo_horas = server_config["HORAS_ARQUIVO"]
+# --- Armazenamento de horas ---
+SCHEMA_SQLITE = """
+CREATE TABLE IF NOT EXISTS registros_horas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id INTEGER NOT NULL,
+    registro_id TEXT,
+    usuario_id INTEGER,
+    nome TEXT NOT NULL,
+    data TEXT NOT NULL,
+    horas REAL NOT NULL,
+    mensagem_id INTEGER,
+    conteudo TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_registros_horas_usuario ON registros_horas (guild_id, usuario_id, data);
+CREATE INDEX IF NOT EXISTS idx_registros_horas_nome ON registros_horas (guild_id, nome, data);
+CREATE INDEX IF NOT EXISTS idx_registros_horas_mensagem ON registros_horas (guild_id, mensagem_id);
+CREATE TABLE IF NOT EXISTS estado_horas (
+    guild_id INTEGER NOT NULL,
+    chave TEXT NOT NULL,
+    valor TEXT NOT NULL,
+    PRIMARY KEY (guild_id, chave)
+);
+"""
+
+def obter_arquivo_horas(guild_id: int = None) -> str:
+    """Retorna o arquivo JSON de horas do servidor"""
+    if guild_id:
+        return get_server_config(guild_id)["HORAS_ARQUIVO"]
+    # Fallback para o arquivo global (usado apenas quando não há contexto de servidor)
+    return HORAS_ARQUIVO
+
+def obter_arquivo_journal(guild_id: int = None) -> str:
+    """Retorna o journal JSONL de mutações do servidor"""
+    return os.path.splitext(obter_arquivo_horas(guild_id))[0] + ".journal.jsonl"
+
+def obter_arquivo_binario(guild_id: int = None) -> str:
+    """Retorna o snapshot binário opcional do servidor"""
+    return os.path.splitext(obter_arquivo_horas(guild_id))[0] + ".bin"
+
+def extrair_id_usuario(nome: str) -> Optional[int]:
+    """Extrai o ID numérico de um identificador de usuário (<@id>, @id ou id)"""
+    limpo = nome.replace('<', '').replace('>', '').replace('@', '').strip()
+    if limpo.isdigit() and len(limpo) > 10:
+        return int(limpo)
+    return None
+
+def copiar_dados(dados: Dict[str, Any]) -> Dict[str, Any]:
+    """Cópia rasa dos dados (registros copiados um a um) para serializar fora do event loop"""
+    copia = {}
+    for chave, valor in dados.items():
+        if chave == "registros":
+            copia[chave] = [dict(registro) for registro in valor]
+        elif isinstance(valor, dict):
+            copia[chave] = dict(valor)
+        elif isinstance(valor, list):
+            copia[chave] = list(valor)
         else:
-            # Fallback para o arquivo global (usado apenas quando não há contexto de servidor)
-            arquivo_horas = HORAS_ARQUIVO
+            copia[chave] = valor
+    return copia
+
+# --- Schema v2 do snapshot ---
+# Cada registro vira uma linha [id, usuario, dia, horas, mensagem_id, processado_em, (extras)]:
+# id só quando não é "m<mensagem_id>", usuario inteiro para menções "<@id>", dia como ordinal,
+# processado_em em segundos desde a época (microssegundos se houver fração; texto se não voltar idêntico).
+# Dados do servidor ficam uma única vez em "servidor".
+VERSAO_SCHEMA = 2
+CAMPOS_REGISTRO_V2 = ["id", "usuario", "dia", "horas", "mensagem_id", "processado_em"]
+CAMPOS_FIXOS_V2 = {"id", "nome", "data", "horas", "mensagem_id", "processado_em", "servidor_id", "servidor_nome",
+                   "usuario_id"}
+MAGIC_BINARIO = b"PONTOv2\0"
+EPOCA = dt.datetime(1970, 1, 1)
+# Horários inteiros a partir deste valor estão em microssegundos (em segundos seria o ano 33658)
+MINIMO_MICROSSEGUNDOS = 10 ** 12
+
+def decodificar_horario(valor: int) -> str:
+    """Converte o horário inteiro do schema v2 (segundos ou microssegundos) de volta ao texto ISO"""
+    if valor >= MINIMO_MICROSSEGUNDOS:
+        return (EPOCA + dt.timedelta(microseconds=valor)).isoformat()
+    return (EPOCA + dt.timedelta(seconds=valor)).isoformat()
+
+def codificar_horario(texto: str):
+    """Horário ISO como inteiro, só quando a decodificação devolve exatamente o mesmo texto"""
+    try:
+        instante = dt.datetime.fromisoformat(texto)
+    except ValueError:
+        return texto
+    if instante.tzinfo is not None:
+        return texto  # O deslocamento de fuso se perderia
+    delta = instante - EPOCA
+    segundos = delta.days * 86400 + delta.seconds
+    valor = segundos * 1_000_000 + delta.microseconds if delta.microseconds else segundos
+    if 0 <= valor and (valor >= MINIMO_MICROSSEGUNDOS) == bool(delta.microseconds) \
+            and decodificar_horario(valor) == texto:
+        return valor
+    return texto
+
+def codificar_v2(dados: Dict[str, Any]) -> Dict[str, Any]:
+    """Converte os dados em memória para o documento do schema v2"""
+    servidor = dict(dados.get("servidor") or {})
+    linhas = []
+    for registro in dados.get("registros", []):
+        if registro.get("servidor_id"):
+            servidor.setdefault("id", registro["servidor_id"])
+        if registro.get("servidor_nome"):
+            servidor.setdefault("nome", registro["servidor_nome"])
         
-        if not os.path.exists(arquivo_horas):
-            print(f"📁 Arquivo {arquivo_horas} não existe, criando...")
-            dados_iniciais = {"usuarios": {}, "registros": []}
-            with open(arquivo_horas, "w", encoding="utf-8") as f:
-                json.dump(dados_iniciais, f, indent=4, ensure_ascii=False)
-            return dados_iniciais
+        nome = registro["nome"]
+        usuario_id = extrair_id_usuario(nome)
+        usuario = usuario_id if usuario_id and nome == f"<@{usuario_id}>" else nome
+        try:
+            dia = dt.date.fromisoformat(registro["data"]).toordinal()
+        except ValueError:
+            dia = registro["data"]
+        mensagem_id = registro.get("mensagem_id")
+        identificador = registro.get("id")
+        if mensagem_id and identificador == f"m{mensagem_id}":
+            identificador = None
+        processado = registro.get("processado_em")
+        if isinstance(processado, str):
+            processado = codificar_horario(processado)
+        
+        linha = [identificador, usuario, dia, registro["horas"], mensagem_id, processado]
+        extras = {chave: valor for chave, valor in registro.items() if chave not in CAMPOS_FIXOS_V2}
+        if registro.get("usuario_id") and registro["usuario_id"] != usuario:
+            extras["usuario_id"] = registro["usuario_id"]  # Apelido resolvido para um ID
+        if extras:
+            linha.append(extras)
+        linhas.append(linha)
+    
+    documento = {"versao": VERSAO_SCHEMA, "servidor": servidor, "campos": CAMPOS_REGISTRO_V2}
+    for chave, valor in dados.items():
+        if chave not in ("registros", "mensagens_ids", "servidor"):
+            documento[chave] = valor
+    documento["registros"] = linhas
+    return documento
+
+def decodificar_v2(documento: Dict[str, Any], linhas=None) -> Dict[str, Any]:
+    """Reconstrói os dados em memória a partir do documento do schema v2"""
+    # Datas, menções e horários se repetem muito: uma única string compartilhada por valor
+    datas: Dict[int, str] = {}
+    nomes: Dict[int, str] = {}
+    horarios: Dict[int, str] = {}
+    registros = []
+    for linha in documento["registros"] if linhas is None else linhas:
+        identificador, usuario, dia, horas, mensagem_id, processado = linha[:6]
+        if type(dia) is int and dia > 0:
+            data = datas.get(dia)
+            if data is None:
+                data = datas[dia] = dt.date.fromordinal(dia).isoformat()
+        else:
+            data = dia
+        if type(usuario) is int:
+            nome = nomes.get(usuario)
+            if nome is None:
+                nome = nomes[usuario] = f"<@{usuario}>"
+            registro = {"data": data, "nome": nome, "horas": horas, "usuario_id": usuario}
+        else:
+            registro = {"data": data, "nome": usuario, "horas": horas}
+        if identificador or mensagem_id:
+            registro["id"] = identificador or f"m{mensagem_id}"
+        if mensagem_id:
+            registro["mensagem_id"] = mensagem_id
+        if processado is not None:
+            if type(processado) is int:
+                horario = horarios.get(processado)
+                if horario is None:
+                    horario = horarios[processado] = decodificar_horario(processado)
+                processado = horario
+            registro["processado_em"] = processado
+        if len(linha) > 6:
+            registro.update(linha[6])
+        registros.append(registro)
+    
+    dados = {chave: valor for chave, valor in documento.items() if chave not in ("versao", "campos", "registros")}
+    dados.setdefault("usuarios", {})
+    dados["registros"] = registros
+    return dados
+
+def gravar_binario(arquivo_binario: str, documento: Dict[str, Any], carimbo: Tuple[int, int]):
+    """Grava o snapshot binário: cabeçalho JSON + colunas numéricas empacotadas"""
+    nomes: Dict[str, int] = {}
+    colunas = {"usuario": array("q"), "dia": array("q"), "horas": array("d"), "mensagem_id": array("q"),
+               "processado_em": array("q")}
+    ids: Dict[int, str] = {}
+    extras: Dict[int, Dict[str, Any]] = {}
+    
+    for posicao, linha in enumerate(documento["registros"]):
+        identificador, usuario, dia, horas, mensagem_id, processado = linha[:6]
+        extra = dict(linha[6]) if len(linha) > 6 else {}
+        if identificador:
+            ids[posicao] = identificador
+        if not isinstance(usuario, int):
+            # Nomes que não são menções vão para a tabela de strings (índice negativo)
+            usuario = -(nomes.setdefault(usuario, len(nomes)) + 1)
+        if not isinstance(dia, int):
+            extra["data"], dia = dia, 0
+        if processado is not None and not isinstance(processado, int):
+            extra["processado_em"], processado = processado, None
+        if extra:
+            extras[posicao] = extra
+        colunas["usuario"].append(usuario)
+        colunas["dia"].append(dia)
+        colunas["horas"].append(horas)
+        colunas["mensagem_id"].append(mensagem_id or 0)
+        colunas["processado_em"].append(-1 if processado is None else processado)
+    
+    cabecalho = {chave: valor for chave, valor in documento.items() if chave != "registros"}
+    cabecalho.update({
+        "carimbo": list(carimbo),
+        "ordem_bytes": sys.byteorder,
+        "total": len(documento["registros"]),
+        "nomes": list(nomes),
+        "ids": ids,
+        "extras": extras
+    })
+    bruto = json.dumps(cabecalho, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    
+    temporario = arquivo_binario + ".tmp"
+    with open(temporario, "wb") as f:
+        f.write(MAGIC_BINARIO)
+        f.write(struct.pack("<I", len(bruto)))
+        f.write(bruto)
+        for coluna in colunas.values():
+            f.write(coluna.tobytes())
+    os.replace(temporario, arquivo_binario)
+
+def ler_binario(arquivo_binario: str, carimbo: Tuple[int, int]) -> Optional[Dict[str, Any]]:
+    """Lê o snapshot binário se ele corresponde ao snapshot JSON atual (senão None)"""
+    with open(arquivo_binario, "rb") as f:
+        conteudo = f.read()
+    if not conteudo.startswith(MAGIC_BINARIO):
+        return None
+    inicio = len(MAGIC_BINARIO) + 4
+    (tamanho,) = struct.unpack_from("<I", conteudo, len(MAGIC_BINARIO))
+    cabecalho = json.loads(conteudo[inicio:inicio + tamanho].decode("utf-8"))
+    if cabecalho["carimbo"] != list(carimbo) or cabecalho["ordem_bytes"] != sys.byteorder:
+        return None  # JSON editado/regravado depois do binário, ou outra arquitetura
+    
+    total = cabecalho["total"]
+    posicao = inicio + tamanho
+    colunas = []
+    for tipo in ("q", "q", "d", "q", "q"):
+        coluna = array(tipo)
+        coluna.frombytes(conteudo[posicao:posicao + total * coluna.itemsize])
+        posicao += total * coluna.itemsize
+        colunas.append(coluna)
+    
+    nomes = cabecalho.pop("nomes")
+    ids = cabecalho.pop("ids")
+    extras = cabecalho.pop("extras")
+    
+    def linhas():
+        for indice, (usuario, dia, horas, mensagem_id, processado) in enumerate(zip(*colunas)):
+            linha = (
+                ids.get(str(indice)) if ids else None,
+                nomes[-usuario - 1] if usuario < 0 else usuario,
+                dia,
+                horas,
+                mensagem_id or None,
+                None if processado < 0 else processado
+            )
+            extra = extras.get(str(indice)) if extras else None
+            yield linha + (extra,) if extra else linha
+    
+    for chave in ("carimbo", "ordem_bytes", "total"):
+        cabecalho.pop(chave)
+    return decodificar_v2(cabecalho, linhas())
+
+class ArmazenamentoJSON:
+    """Armazena os dados de horas em um snapshot JSON + journal JSONL por servidor"""
+
+    nome = "json"
+    usa_journal = True  # Mutações vão para o journal (em thread); o snapshot é gravado depois
+
+    def carregar(self, guild_id: int = None) -> Dict[str, Any]:
+        """Carrega o snapshot do servidor e reaplica o journal de mutações"""
+        arquivo_horas = obter_arquivo_horas(guild_id)
+        try:
+            if not os.path.exists(arquivo_horas):
+                print(f"📁 Arquivo {arquivo_horas} não existe, criando...")
+                dados = {"usuarios": {}, "registros": []}
+                self.gravar_snapshot(arquivo_horas, dados, guild_id)
+            else:
+                dados = self.ler_snapshot(arquivo_horas, guild_id)
+            
+            # Snapshot + journal (o journal selado existe se uma compactação foi interrompida)
+            journal = obter_arquivo_journal(guild_id)
+            for arquivo in (journal + ".compactando", journal):
+                mutacoes = self.ler_journal(arquivo)
+                if mutacoes:
+                    aplicar_mutacoes(dados, mutacoes)
+            
+            # Compactação interrompida (queda ou erro na gravação): incorporar tudo em um novo snapshot
+            if os.path.exists(journal + ".compactando"):
+                print(f"♻️ Journal selado de uma compactação interrompida encontrado em {arquivo_horas}, incorporando...")
+                self.salvar(dados, guild_id)
+            return dados
+                
+        except Exception as e:
+            print(f"❌ Erro ao carregar horas do arquivo {arquivo_horas}: {e}")
+            return {"usuarios": {}, "registros": []}
+
+    def ler_snapshot(self, arquivo_horas: str, guild_id: int = None) -> Dict[str, Any]:
+        """Lê o snapshot (binário se válido, senão JSON), migrando o schema v1 automaticamente"""
+        if HORAS_SNAPSHOT_BINARIO and os.path.exists(obter_arquivo_binario(guild_id)):
+            info = os.stat(arquivo_horas)
+            try:
+                dados = ler_binario(obter_arquivo_binario(guild_id), (info.st_mtime_ns, info.st_size))
+                if dados is not None:
+                    return dados
+            except Exception as e:
+                print(f"⚠️ Snapshot binário inválido ({obter_arquivo_binario(guild_id)}), usando JSON: {e}")
         
         with open(arquivo_horas, "r", encoding="utf-8") as f:
-            dados = json.load(f)
+            documento = json.load(f)
+        if documento.get("versao") == VERSAO_SCHEMA:
+            return decodificar_v2(documento)
+        
+        # Schema v1 (registros como objetos completos): converter e guardar o original
+        os.replace(arquivo_horas, arquivo_horas + ".v1.bak")
+        try:
+            self.gravar_snapshot(arquivo_horas, documento, guild_id)
+        except Exception:
+            os.replace(arquivo_horas + ".v1.bak", arquivo_horas)
+            raise
+        print(f"📦 {arquivo_horas} migrado para o schema v{VERSAO_SCHEMA} (original em {arquivo_horas}.v1.bak)")
+        return decodificar_v2(codificar_v2(documento))
+
+    def ler_journal(self, arquivo: str) -> List[Dict[str, Any]]:
+        """Lê as mutações de um journal, ignorando uma última linha incompleta"""
+        if not os.path.exists(arquivo):
+            return []
+        
+        mutacoes = []
+        with open(arquivo, "r", encoding="utf-8") as f:
+            for linha in f:
+                linha = linha.strip()
+                if not linha:
+                    continue
+                try:
+                    mutacoes.append(json.loads(linha))
+                except json.JSONDecodeError:
+                    print(f"⚠️ Linha inválida ignorada no journal {arquivo}")
+        return mutacoes
+
+    def gravar_snapshot(self, arquivo_horas: str, dados: Dict[str, Any], guild_id: int = None):
+        """Grava o snapshot v2 de forma atômica (backups ficam a cargo do HorasStore)"""
+        documento = codificar_v2(dados)
+        temporario = arquivo_horas + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump(documento, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(temporario, arquivo_horas)
+        
+        if HORAS_SNAPSHOT_BINARIO:
+            info = os.stat(arquivo_horas)
+            gravar_binario(obter_arquivo_binario(guild_id), documento, (info.st_mtime_ns, info.st_size))
+
+    def salvar(self, dados: Dict[str, Any], guild_id: int = None) -> bool:
+        """Salva um snapshot completo do servidor e descarta o journal"""
+        arquivo_horas = obter_arquivo_horas(guild_id)
+        try:
+            self.gravar_snapshot(arquivo_horas, dados, guild_id)
+            
+            # O snapshot já contém todas as mutações do journal
+            journal = obter_arquivo_journal(guild_id)
+            for arquivo in (journal + ".compactando", journal):
+                if os.path.exists(arquivo):
+                    os.remove(arquivo)
+            
+            print(f"💾 Dados salvos em {arquivo_horas}")
+            return True
+            
+        except Exception as e:
+            print(f"❌ Erro ao salvar horas no arquivo {arquivo_horas}: {e}")
+            return False
+
+    def registrar(self, dados: Dict[str, Any], mutacoes: List[Dict[str, Any]], guild_id: int = None) -> bool:
+        """Acrescenta as mutações ao journal (custo proporcional à mudança)"""
+        journal = obter_arquivo_journal(guild_id)
+        tamanho = self.tamanho_journal(guild_id)
+        try:
+            with open(journal, "a", encoding="utf-8") as f:
+                for mutacao in mutacoes:
+                    f.write(json.dumps(mutacao, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            return True
+            
+        except Exception as e:
+            print(f"❌ Erro ao gravar journal {journal}: {e}")
+            # Linhas parciais seriam reaplicadas no replay, mas o lote foi desfeito na memória
+            try:
+                os.truncate(journal, tamanho)
+            except OSError:
+                pass
+            return False
+
+    def tamanho_journal(self, guild_id: int = None) -> int:
+        """Tamanho atual do journal em bytes"""
+        try:
+            return os.path.getsize(obter_arquivo_journal(guild_id))
+        except FileNotFoundError:
+            return 0
+
+    def compactar(self, dados: Dict[str, Any], guild_id: int = None) -> Optional[asyncio.Future]:
+        """Incorpora o journal em um novo snapshot; serialização e gravação rodam em uma thread.
+        
+        Quem chama garante que não há outra compactação do servidor em andamento (HorasStore.compactacao)."""
+        arquivo_horas = obter_arquivo_horas(guild_id)
+        journal = obter_arquivo_journal(guild_id)
+        selado = journal + ".compactando"
+        
+        # Selar o journal atual: novas mutações vão para um journal novo.
+        # Um selado que sobrou de uma gravação que falhou recebe o journal no final (nada é sobrescrito)
+        if os.path.exists(journal):
+            if os.path.exists(selado):
+                with open(journal, "r", encoding="utf-8") as origem, open(selado, "a", encoding="utf-8") as destino:
+                    destino.write(origem.read())
+                    destino.flush()
+                    os.fsync(destino.fileno())
+                os.remove(journal)
+            else:
+                os.replace(journal, selado)
+        copia = copiar_dados(dados)
+        
+        def gravar() -> bool:
+            try:
+                self.gravar_snapshot(arquivo_horas, copia, guild_id)
+                if os.path.exists(selado):
+                    os.remove(selado)
+                print(f"🗜️ Journal compactado em {arquivo_horas}")
+                return True
+            except Exception as e:
+                print(f"❌ Erro ao compactar journal de {arquivo_horas}: {e}")
+                return False
+        
+        try:
+            return asyncio.get_running_loop().run_in_executor(None, gravar)
+        except RuntimeError:
+            gravar()
+            return None
+
+    def assinatura(self, guild_id: int = None) -> Tuple:
+        """Identifica a versão em disco pelo mtime/tamanho do snapshot e dos journals"""
+        journal = obter_arquivo_journal(guild_id)
+        partes = []
+        for arquivo in (obter_arquivo_horas(guild_id), journal + ".compactando", journal):
+            try:
+                info = os.stat(arquivo)
+                partes.append((info.st_mtime_ns, info.st_size))
+            except FileNotFoundError:
+                partes.append(None)
+        return tuple(partes)
+
+class ArmazenamentoSQLite:
+    """Armazena os dados de horas no SQLite (ponto.db) em modo WAL"""
+
+    nome = "sqlite"
+    usa_journal = False  # Cada commit já é durável no WAL
+
+    def __init__(self, caminho: str):
+        self.caminho = caminho
+        self.conexao: Optional[sqlite3.Connection] = None
+
+    def conectar(self) -> sqlite3.Connection:
+        """Abre (uma única vez) a conexão com o banco e garante o schema"""
+        if self.conexao is None:
+            conexao = sqlite3.connect(self.caminho)
+            conexao.execute("PRAGMA journal_mode=WAL")
+            conexao.execute("PRAGMA synchronous=NORMAL")
+            conexao.executescript(SCHEMA_SQLITE)
+            self.migrar_registro_id(conexao)
+            self.conexao = conexao
+        return self.conexao
+
+    def migrar_registro_id(self, conexao: sqlite3.Connection):
+        """Bancos antigos: cria a coluna registro_id (ID do registro) e a preenche a partir do conteúdo"""
+        colunas = {linha[1] for linha in conexao.execute("PRAGMA table_info(registros_horas)")}
+        with conexao:
+            if "registro_id" not in colunas:
+                conexao.execute("ALTER TABLE registros_horas ADD COLUMN registro_id TEXT")
+                conexao.executemany(
+                    "UPDATE registros_horas SET registro_id = ? WHERE id = ?",
+                    [
+                        (json.loads(conteudo).get("id"), linha_id)
+                        for linha_id, conteudo in conexao.execute("SELECT id, conteudo FROM registros_horas")
+                    ]
+                )
+            conexao.execute(
+                "CREATE INDEX IF NOT EXISTS idx_registros_horas_registro ON registros_horas (guild_id, registro_id)"
+            )
+
+    @staticmethod
+    def linha_registro(registro: Dict[str, Any]) -> Tuple:
+        """Colunas (usuario_id, nome, data, horas, mensagem_id, conteudo) de um registro"""
+        return (
+            registro.get("usuario_id") or extrair_id_usuario(registro["nome"]),
+            registro["nome"],
+            registro["data"],
+            registro["horas"],
+            registro.get("mensagem_id"),
+            json.dumps(registro, sort_keys=True, ensure_ascii=False)
+        )
+
+    def possui_dados(self, guild_id: int) -> bool:
+        """Verifica se o servidor já tem dados no banco"""
+        conexao = self.conectar()
+        for tabela in ("registros_horas", "estado_horas"):
+            if conexao.execute(f"SELECT 1 FROM {tabela} WHERE guild_id = ? LIMIT 1", (guild_id,)).fetchone():
+                return True
+        return False
+
+    def carregar(self, guild_id: int = None) -> Dict[str, Any]:
+        """Carrega os dados de horas do servidor a partir do banco"""
+        try:
+            conexao = self.conectar()
+            dados = {"usuarios": {}, "registros": []}
+            for chave, valor in conexao.execute(
+                "SELECT chave, valor FROM estado_horas WHERE guild_id = ?", (guild_id,)
+            ):
+                dados[chave] = json.loads(valor)
+            dados["registros"] = [
+                json.loads(conteudo) for (conteudo,) in conexao.execute(
+                    "SELECT conteudo FROM registros_horas WHERE guild_id = ? ORDER BY id", (guild_id,)
+                )
+            ]
             return dados
+        except Exception as e:
+            print(f"❌ Erro ao carregar horas do banco {self.caminho}: {e}")
+            return {"usuarios": {}, "registros": []}
+
+    def salvar(self, dados: Dict[str, Any], guild_id: int = None) -> bool:
+        """Grava apenas as linhas que mudaram desde o último salvamento"""
+        try:
+            conexao = self.conectar()
             
-    except Exception as e:
-        print(f"❌ Erro ao carregar horas do arquivo {arquivo_horas}: {e}")
-        return {"usuarios": {}, "registros": []}
+            # Registros idênticos (mesmo conteúdo canônico) permanecem intocados
+            existentes: Dict[str, List[int]] = {}
+            for linha_id, conteudo in conexao.execute(
+                "SELECT id, conteudo FROM registros_horas WHERE guild_id = ?", (guild_id,)
+            ):
+                existentes.setdefault(conteudo, []).append(linha_id)
+            
+            novos = []
+            for registro in dados.get("registros", []):
+                conteudo = json.dumps(registro, sort_keys=True, ensure_ascii=False)
+                linhas = existentes.get(conteudo)
+                if linhas:
+                    linhas.pop()
+                    continue
+                novos.append((guild_id, registro.get("id")) + self.linha_registro(registro))
+            removidos = [(linha_id,) for linhas in existentes.values() for linha_id in linhas]
+            
+            with conexao:
+                conexao.executemany("DELETE FROM registros_horas WHERE id = ?", removidos)
+                conexao.executemany(
+                    "INSERT INTO registros_horas (guild_id, registro_id, usuario_id, nome, data, horas, mensagem_id, "
+                    "conteudo) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    novos
+                )
+                conexao.executemany(
+                    "INSERT OR REPLACE INTO estado_horas (guild_id, chave, valor) VALUES (?, ?, ?)",
+                    [
+                        (guild_id, chave, json.dumps(valor, ensure_ascii=False))
+                        for chave, valor in dados.items() if chave not in ("registros", "mensagens_ids")
+                    ]
+                )
+            
+            if novos or removidos:
+                print(f"💾 Dados salvos em {self.caminho}: +{len(novos)} / -{len(removidos)} registros")
+            return True
+            
+        except Exception as e:
+            print(f"❌ Erro ao salvar horas no banco {self.caminho}: {e}")
+            return False
+
+    def gravar_registro(self, conexao: sqlite3.Connection, guild_id: int, registro: Dict[str, Any]):
+        """Atualiza a linha do registro pelo ID (mantendo a posição) ou a insere se ainda não existe"""
+        linha = self.linha_registro(registro)
+        cursor = conexao.execute(
+            "UPDATE registros_horas SET usuario_id = ?, nome = ?, data = ?, horas = ?, mensagem_id = ?, conteudo = ? "
+            "WHERE guild_id = ? AND registro_id = ?",
+            linha + (guild_id, registro["id"])
+        )
+        if cursor.rowcount == 0:
+            conexao.execute(
+                "INSERT INTO registros_horas (guild_id, registro_id, usuario_id, nome, data, horas, mensagem_id, "
+                "conteudo) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (guild_id, registro["id"]) + linha
+            )
+
+    def registrar(self, dados: Dict[str, Any], mutacoes: List[Dict[str, Any]], guild_id: int = None) -> bool:
+        """Aplica cada mutação como INSERT/UPDATE/DELETE pelo ID do registro (custo proporcional à mudança)"""
+        try:
+            conexao = self.conectar()
+            with conexao:
+                for mutacao in mutacoes:
+                    op = mutacao["op"]
+                    if op == "adicionar":
+                        self.gravar_registro(conexao, guild_id, mutacao["registro"])
+                    elif op == "alterar":
+                        linha = conexao.execute(
+                            "SELECT conteudo FROM registros_horas WHERE guild_id = ? AND registro_id = ?",
+                            (guild_id, mutacao["id"])
+                        ).fetchone()
+                        if linha:
+                            registro = json.loads(linha[0])
+                            registro.update(mutacao["campos"])
+                            self.gravar_registro(conexao, guild_id, registro)
+                    elif op == "remover":
+                        conexao.executemany(
+                            "DELETE FROM registros_horas WHERE guild_id = ? AND registro_id = ?",
+                            [(guild_id, registro_id) for registro_id in mutacao["ids"]]
+                        )
+                    elif op == "estado":
+                        conexao.execute(
+                            "INSERT OR REPLACE INTO estado_horas (guild_id, chave, valor) VALUES (?, ?, ?)",
+                            (guild_id, mutacao["chave"], json.dumps(dados.get(mutacao["chave"], {}), ensure_ascii=False))
+                        )
+            return True
+            
+        except Exception as e:
+            print(f"❌ Erro ao gravar mutações no banco {self.caminho}: {e}")
+            return False
+
+    def assinatura(self, guild_id: int = None) -> int:
+        """PRAGMA data_version muda quando outra conexão grava no banco"""
+        return self.conectar().execute("PRAGMA data_version").fetchone()[0]
 
-def salvar_horas(dados: Dict[str, Any], guild_id: int = None) -> bool:
-    """Salva os dados de horas no arquivo JSON específico do servidor"""
+    def migrar_json(self, guild_id: int) -> bool:
+        """Importa (uma única vez) o arquivo JSON do servidor para o banco"""
+        if self.possui_dados(guild_id):
+            return False
+        
+        arquivo_horas = obter_arquivo_horas(guild_id)
+        if not os.path.exists(arquivo_horas):
+            return False
+        
+        dados = ArmazenamentoJSON().carregar(guild_id)
+        dados.setdefault("usuarios", {})
+        if self.salvar(dados, guild_id):
+            print(f"📦 {len(dados.get('registros', []))} registros migrados de {arquivo_horas} para {self.caminho}")
+            return True
+        return False
+
+_armazenamento = None
+
+def obter_armazenamento():
+    """Retorna o backend de armazenamento configurado (HORAS_BACKEND)"""
+    global _armazenamento
+    if _armazenamento is None:
+        if HORAS_BACKEND == "sqlite":
+            _armazenamento = ArmazenamentoSQLite(HORAS_DB)
+        else:
+            _armazenamento = ArmazenamentoJSON()
+    return _armazenamento
+
+def migrar_json_para_sqlite() -> int:
+    """Migra os arquivos JSON de todos os servidores permitidos para o SQLite"""
+    armazenamento = obter_armazenamento()
+    if not isinstance(armazenamento, ArmazenamentoSQLite):
+        return 0
+    return sum(1 for guild_id in ALLOWED_SERVERS if armazenamento.migrar_json(guild_id))
+
+# --- Backups rotativos ---
+def obter_prefixo_backup(guild_id: int = None) -> str:
+    """Prefixo dos backups do servidor (nome do arquivo de horas sem extensão)"""
+    return os.path.splitext(os.path.basename(obter_arquivo_horas(guild_id)))[0]
+
+def data_do_backup(nome: str, prefixo: str) -> Optional[dt.datetime]:
+    """Extrai o horário do nome do backup (None se não for um backup deste prefixo)"""
+    if not (nome.startswith(prefixo + "_") and nome.endswith(".json.gz")):
+        return None
+    carimbo = nome[len(prefixo) + 1:-len(".json.gz")]
+    for formato in ("%Y%m%d_%H%M%S_%f", "%Y%m%d_%H%M%S"):  # Backups antigos não têm microssegundos
+        try:
+            return dt.datetime.strptime(carimbo, formato)
+        except ValueError:
+            continue
+    return None
+
+def listar_backups(guild_id: int = None) -> List[Tuple[str, dt.datetime]]:
+    """Lista os backups do servidor, do mais recente ao mais antigo"""
+    prefixo = obter_prefixo_backup(guild_id)
     try:
-        # Determinar qual arquivo usar baseado no servidor
-        if guild_id:
-            server_config = get_server_config(guild_id)
-            arquivo_horas = server_config["HORAS_ARQUIVO"]
+        nomes = os.listdir(BACKUP_DIR)
+    except FileNotFoundError:
+        return []
+    backups = [(nome, data_do_backup(nome, prefixo)) for nome in nomes]
+    return sorted([(nome, data) for nome, data in backups if data], key=lambda b: b[1], reverse=True)
+
+def aplicar_retencao(guild_id: int = None, agora: dt.datetime = None):
+    """Mantém o último backup de cada hora, dia e semana dentro das janelas de retenção"""
+    agora = agora or dt.datetime.now()
+    baldes = set()
+    for posicao, (nome, data) in enumerate(listar_backups(guild_id)):
+        idade = agora - data
+        if posicao == 0:
+            balde = ("mais_recente",)
+        elif idade <= dt.timedelta(hours=RETENCAO_HORAS):
+            balde = ("hora", data.strftime("%Y%m%d%H"))
+        elif idade <= dt.timedelta(days=RETENCAO_DIAS):
+            balde = ("dia", data.date())
+        elif idade <= dt.timedelta(weeks=RETENCAO_SEMANAS):
+            balde = ("semana", data.isocalendar()[:2])
+        else:
+            balde = None
+        
+        # Lista do mais recente ao mais antigo: o primeiro de cada balde fica
+        if balde and balde not in baldes:
+            baldes.add(balde)
         else:
-            arquivo_horas = HORAS_ARQUIVO
-        
-        # Fazer backup antes de salvar
-        if os.path.exists(arquivo_horas):
-            if not os.path.exists(BACKUP_DIR):
-                os.makedirs(BACKUP_DIR, exist_ok=True)
-            backup_name = f"horas_backup_{dt.datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-            backup_path = os.path.join(BACKUP_DIR, backup_name)
             try:
-                with open(backup_path, "w", encoding="utf-8") as f:
-                    json.dump(carregar_horas(guild_id), f, indent=4, ensure_ascii=False)
-            except Exception:
-                pass
+                os.remove(os.path.join(BACKUP_DIR, nome))
+            except FileNotFoundError:
+                pass  # Já removido por outra rotação
+
+def gravar_backup(dados: Dict[str, Any], guild_id: int = None) -> bool:
+    """Grava um backup gzip e aplica a retenção (executado em uma thread)"""
+    temporario = None
+    try:
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        nome = f"{obter_prefixo_backup(guild_id)}_{dt.datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.json.gz"
+        caminho = os.path.join(BACKUP_DIR, nome)
+        # Temporário exclusivo: dois backups simultâneos nunca escrevem no mesmo arquivo
+        descritor, temporario = tempfile.mkstemp(dir=BACKUP_DIR, prefix=nome, suffix=".tmp")
+        with os.fdopen(descritor, "wb") as bruto, gzip.open(bruto, "wt", encoding="utf-8") as f:
+            json.dump(codificar_v2(dados), f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(temporario, caminho)
+        temporario = None
+        aplicar_retencao(guild_id)
+        print(f"🗄️ Backup criado: {nome}")
+        return True
+    except Exception as e:
+        print(f"❌ Erro ao criar backup de {obter_arquivo_horas(guild_id)}: {e}")
+        return False
+    finally:
+        if temporario and os.path.exists(temporario):
+            os.remove(temporario)
+
+def carregar_backup(nome: str, guild_id: int = None) -> Dict[str, Any]:
+    """Lê um backup do servidor"""
+    if data_do_backup(nome, obter_prefixo_backup(guild_id)) is None or os.path.basename(nome) != nome:
+        raise ValueError(f"Backup inválido para este servidor: {nome}")
+    with gzip.open(os.path.join(BACKUP_DIR, nome), "rt", encoding="utf-8") as f:
+        documento = json.load(f)
+    return decodificar_v2(documento) if documento.get("versao") == VERSAO_SCHEMA else documento
+
+# --- Mutações dos registros ---
+def gerar_id_registro(registro: Dict[str, Any]) -> str:
+    """Gera o identificador estável de um registro"""
+    if registro.get("mensagem_id"):
+        return f"m{registro['mensagem_id']}"
+    return f"a{uuid.uuid4().hex[:12]}"
+
+def garantir_ids_registros(dados: Dict[str, Any]) -> bool:
+    """Atribui IDs aos registros antigos que ainda não possuem; retorna True se algum mudou"""
+    alterado = False
+    for registro in dados.get("registros", []):
+        if "id" not in registro:
+            registro["id"] = gerar_id_registro(registro)
+            alterado = True
+    return alterado
+
+def normalizar_alias(nome: str) -> str:
+    """Forma canônica de um apelido (sem <, > e @, minúsculo) usada como chave em dados["aliases"]"""
+    return nome.replace('<', '').replace('>', '').replace('@', '').strip().lower()
+
+def chave_usuario(registro: Dict[str, Any]):
+    """Chave do usuário do registro: o ID inteiro, ou o nome normalizado se ainda não foi resolvido"""
+    usuario_id = registro.get("usuario_id")
+    if usuario_id:
+        return usuario_id
+    return normalizar_nome_usuario(registro["nome"])
+
+def resolver_usuario(dados: Dict[str, Any], identificador):
+    """Converte um identificador (menção, ID ou apelido conhecido) na chave do usuário"""
+    if isinstance(identificador, int):
+        return identificador
+    usuario_id = resolver_usuario_id(dados, identificador)
+    if usuario_id:
+        return usuario_id
+    return normalizar_nome_usuario(identificador)
+
+def resolver_usuario_id(dados: Dict[str, Any], nome: str) -> Optional[int]:
+    """ID do usuário de um nome de registro: menção ou apelido já associado (None se não resolvível)"""
+    return extrair_id_usuario(nome) or dados.get("aliases", {}).get(normalizar_alias(nome))
+
+def garantir_usuarios_ids(dados: Dict[str, Any]) -> bool:
+    """Atribui usuario_id aos registros resolvíveis (menções e apelidos conhecidos); retorna True se algum mudou"""
+    alterado = False
+    for registro in dados.get("registros", []):
+        if registro.get("usuario_id"):
+            continue
+        nome = registro.get("nome", "")
+        usuario_id = resolver_usuario_id(dados, nome)
+        if usuario_id:
+            registro["usuario_id"] = usuario_id
+            alterado = True
+    return alterado
+
+class IndiceRegistros:
+    """Posição de cada registro na lista por ID e mensagens já importadas (mantidos a cada mutação)"""
+
+    def __init__(self, registros: List[Dict[str, Any]]):
+        self.registros = registros
+        self.posicoes: Dict[str, int] = {registro.get("id"): posicao for posicao, registro in enumerate(registros)}
+        self.mensagens: Set[int] = {registro["mensagem_id"] for registro in registros if registro.get("mensagem_id")}
+
+    def obter(self, registro_id: str) -> Optional[Dict[str, Any]]:
+        """Registro com o ID informado (None se não existe)"""
+        posicao = self.posicoes.get(registro_id)
+        return None if posicao is None else self.registros[posicao]
+
+    def adicionar(self, registro: Dict[str, Any]):
+        """Acrescenta um registro novo no fim da lista"""
+        self.posicoes[registro["id"]] = len(self.registros)
+        self.registros.append(registro)
+        if registro.get("mensagem_id"):
+            self.mensagens.add(registro["mensagem_id"])
+
+    def remover(self, registro_id: str) -> Optional[Dict[str, Any]]:
+        """Remove em O(1): o último registro passa a ocupar a posição do removido"""
+        posicao = self.posicoes.pop(registro_id, None)
+        if posicao is None:
+            return None
+        registro = self.registros[posicao]
+        ultimo = self.registros.pop()
+        if posicao < len(self.registros):
+            self.registros[posicao] = ultimo
+            self.posicoes[ultimo.get("id")] = posicao
+        self.mensagens.discard(registro.get("mensagem_id"))
+        return registro
+
+def expandir_desconto(registros: List[Dict[str, Any]], mutacao: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Converte um desconto relativo ("tirar N horas do usuário") em alterações/remoções sobre o estado atual"""
+    registros_usuario = [
+        registro for registro in registros
+        if chave_usuario(registro) == mutacao["usuario"] and (mutacao.get("data") is None or registro["data"] == mutacao["data"])
+    ]
+    # Mais recentes primeiro (ID desempata, para não depender da ordem da lista)
+    registros_usuario.sort(key=lambda registro: (registro["data"], registro["id"]), reverse=True)
+    
+    horas_restantes = mutacao["horas"]
+    concretas = []
+    ids_removidos = []
+    for registro in registros_usuario:
+        if horas_restantes <= 0:
+            break
+        if registro["horas"] > horas_restantes:
+            concretas.append({"op": "alterar", "id": registro["id"], "campos": {
+                "horas": registro["horas"] - horas_restantes,
+                "modificado_em": mutacao.get("modificado_em"),
+                "modificado_por": mutacao.get("modificado_por"),
+                "horas_removidas": horas_restantes
+            }})
+            horas_restantes = 0
+        else:
+            horas_restantes -= registro["horas"]
+            ids_removidos.append(registro["id"])
+    if ids_removidos:
+        concretas.append({"op": "remover", "ids": ids_removidos})
+    
+    # Resultado para quem enfileirou (o journal recebe só as mutações concretas)
+    mutacao["resultado"] = {"horas_removidas": mutacao["horas"] - horas_restantes}
+    return concretas
+
+def aplicar_mutacoes(dados: Dict[str, Any], mutacoes: List[Dict[str, Any]],
+                     observador: Callable[[Optional[Dict[str, Any]], Optional[Dict[str, Any]]], None] = None,
+                     indice: IndiceRegistros = None) -> List[Dict[str, Any]]:
+    """Aplica mutações aos dados em memória (idempotente, usado também no replay do journal)
+
+    O observador recebe (registro_antes, registro_depois) de cada registro afetado. Sem o índice
+    residente do store (replay do journal), um índice temporário é montado uma vez para o lote.
+    Descontos relativos são resolvidos contra o estado do momento; retorna as mutações concretas aplicadas.
+    """
+    registros = dados.setdefault("registros", [])
+    if indice is None:
+        indice = IndiceRegistros(registros)
+    aplicadas = []
+    
+    for mutacao in mutacoes:
+        op = mutacao["op"]
+        
+        if op == "descontar":
+            concretas = expandir_desconto(registros, mutacao)
+            aplicadas.extend(aplicar_mutacoes(dados, concretas, observador, indice))
+            continue
+        aplicadas.append(mutacao)
+        
+        if op == "adicionar":
+            registro = mutacao["registro"]
+            if not registro.get("usuario_id"):
+                # Nome em texto livre de um apelido conhecido: mesma chave dos registros antigos da pessoa
+                usuario_id = resolver_usuario_id(dados, registro["nome"])
+                if usuario_id:
+                    registro["usuario_id"] = usuario_id
+            existente = indice.obter(registro["id"])
+            if existente is not None:
+                antes = dict(existente)
+                existente.clear()
+                existente.update(registro)
+                indice.mensagens.discard(antes.get("mensagem_id"))
+                if existente.get("mensagem_id"):
+                    indice.mensagens.add(existente["mensagem_id"])
+                if observador:
+                    observador(antes, existente)
+            else:
+                registro = dict(registro)
+                indice.adicionar(registro)
+                if observador:
+                    observador(None, registro)
         
-        # Salvar dados
-        with open(arquivo_horas, "w", encoding="utf-8") as f:
-            json.dump(dados, f, indent=4, ensure_ascii=False)
+        elif op == "alterar":
+            registro = indice.obter(mutacao["id"])
+            if registro is not None:
+                antes = dict(registro)
+                registro.update(mutacao["campos"])
+                if observador:
+                    observador(antes, registro)
         
-        print(f"💾 Dados salvos em {arquivo_horas}")
+        elif op == "remover":
+            for registro_id in mutacao["ids"]:
+                registro = indice.remover(registro_id)
+                if registro is None:
+                    continue
+                if observador:
+                    observador(registro, None)
+        
+        elif op == "estado":
+            dados.setdefault(mutacao["chave"], {}).update(mutacao["valores"])
+    
+    return aplicadas
+
+# --- Rankings incrementais por período ---
+def obter_periodo(periodo_tipo: str) -> Tuple[dt.date, dt.date]:
+    """Retorna o período atual do tipo informado ("semanal" ou "mensal")"""
+    return obter_periodo_semanal() if periodo_tipo == "semanal" else obter_periodo_mensal()
+
+class RankingPeriodo:
+    """Ranking de um período (semana/mês atual) mantido ordenado a cada mudança de horas"""
+
+    def __init__(self, periodo_tipo: str, rollup: "RollupDiario"):
+        self.periodo_tipo = periodo_tipo
+        self.reiniciar(rollup)
+
+    def reiniciar(self, rollup: "RollupDiario"):
+        """(Re)constrói o ranking para o período atual a partir do rollup diário"""
+        self.data_inicio, self.data_fim = obter_periodo(self.periodo_tipo)
+        self.inicio_texto = self.data_inicio.strftime("%Y-%m-%d")
+        self.fim_texto = self.data_fim.strftime("%Y-%m-%d")
+        self.horas: Dict[Any, float] = dict(rollup.ranking_periodo(self.data_inicio, self.data_fim))
+        # (−horas, texto da chave, chave): IDs inteiros e nomes não resolvidos convivem na ordenação
+        self.ordenado: List[Tuple[float, str, Any]] = sorted(
+            (-horas, str(usuario), usuario) for usuario, horas in self.horas.items()
+        )
+        self.total = sum(self.horas.values())
+
+    def periodo_vigente(self) -> bool:
+        """Verifica se o período do ranking ainda é o atual (virada de semana/mês)"""
+        return (self.data_inicio, self.data_fim) == obter_periodo(self.periodo_tipo)
+
+    def ajustar(self, registro: Dict[str, Any], sinal: int):
+        """Move a posição do usuário do registro, se a data cair no período"""
+        try:
+            if not (self.inicio_texto <= registro["data"] <= self.fim_texto):
+                return
+            usuario = chave_usuario(registro)
+            delta = sinal * float(registro["horas"])
+        except Exception:
+            return
+        
+        anterior = self.horas.get(usuario)
+        if anterior is not None:
+            entrada = (-anterior, str(usuario), usuario)
+            posicao = bisect.bisect_left(self.ordenado, entrada)
+            if posicao < len(self.ordenado) and self.ordenado[posicao] == entrada:
+                del self.ordenado[posicao]
+            self.total -= anterior
+        
+        atual = (anterior or 0.0) + delta
+        if atual > 1e-9:
+            self.horas[usuario] = atual
+            bisect.insort(self.ordenado, (-atual, str(usuario), usuario))
+            self.total += atual
+        else:
+            self.horas.pop(usuario, None)
+
+    def atualizar(self, antes: Optional[Dict[str, Any]], depois: Optional[Dict[str, Any]]):
+        """Observador de mutações: aplica a diferença entre as versões do registro"""
+        if antes is not None:
+            self.ajustar(antes, -1)
+        if depois is not None:
+            self.ajustar(depois, 1)
+
+    def top(self, quantidade: int) -> List[Tuple[str, float]]:
+        """Primeiras posições do ranking, sem reordenar"""
+        return [(usuario, -horas_negativas) for horas_negativas, _, usuario in self.ordenado[:quantidade]]
+
+    def __len__(self) -> int:
+        return len(self.ordenado)
+
+# --- Cache residente por servidor ---
+# Acima desta janela (em dias), rankings usam o motor colunar
+JANELA_MAXIMA_ROLLUP = 62
+
+class HorasStore:
+    """Mantém em memória os dados de horas de um servidor, compartilhados por todos os comandos"""
+
+    def __init__(self, guild_id: int = None):
+        self.guild_id = guild_id
+        self.dados: Optional[Dict[str, Any]] = None
+        self.assinatura = None
+        self.versao = 0  # Incrementa a cada mudança (para caches derivados)
+        self.rollup: Optional[RollupDiario] = None
+        self.colunas: Optional[ColunasRegistros] = None
+        self.indices_usuarios: Optional[IndicesUsuarios] = None
+        self.rankings: Dict[str, RankingPeriodo] = {}
+        self.indice_registros: Optional[IndiceRegistros] = None
+        self.mutacoes_desde_backup = 0
+        self.ultimo_backup: Optional[dt.datetime] = None
+        self.backup: Optional[asyncio.Future] = None  # Backup em andamento (um por servidor)
+        self.sujo = False  # Há mutações só no journal, ainda não no snapshot
+        self.ultimo_flush = dt.datetime.now()
+        self.gravacoes_pendentes = 0  # Gravações nossas em andamento (não são alterações externas)
+        self.compactacao: Optional[asyncio.Future] = None
+
+    def obter(self) -> Dict[str, Any]:
+        """Retorna os dados residentes, recarregando se o arquivo foi editado externamente"""
+        armazenamento = obter_armazenamento()
+        if self.dados is not None and (self.gravacoes_pendentes
+                                       or armazenamento.assinatura(self.guild_id) == self.assinatura):
+            return self.dados
+        
+        if self.dados is not None:
+            print(f"🔄 Alteração externa detectada nos dados de horas ({obter_arquivo_horas(self.guild_id)}), recarregando...")
+        
+        dados = armazenamento.carregar(self.guild_id)
+        # Registros antigos recebem IDs estáveis e IDs de usuário uma única vez
+        dados.pop("mensagens_ids", None)  # Índice persistido antigo: agora residente em IndiceRegistros
+        if garantir_ids_registros(dados) | garantir_usuarios_ids(dados):
+            armazenamento.salvar(dados, self.guild_id)
+        
+        self.dados = dados
+        self.assinatura = armazenamento.assinatura(self.guild_id)
+        self.versao += 1
+        self.limpar_indices()
+        return self.dados
+
+    def limpar_indices(self):
+        """Descarta os índices derivados (reconstruídos sob demanda)"""
+        self.rollup = None
+        self.colunas = None
+        self.indices_usuarios = None
+        self.rankings = {}
+        self.indice_registros = None
+
+    def obter_rollup(self) -> "RollupDiario":
+        """Retorna o rollup diário (construído uma vez, depois mantido incrementalmente)"""
+        dados = self.obter()
+        if self.rollup is None:
+            self.rollup = RollupDiario(dados.get("registros", []))
+        return self.rollup
+
+    def obter_colunas(self) -> "ColunasRegistros":
+        """Retorna a forma colunar dos registros (novos registros são acrescentados, o resto reconstrói)"""
+        dados = self.obter()
+        if self.colunas is None:
+            self.colunas = ColunasRegistros.de_registros(dados.get("registros", []))
+        return self.colunas
+
+    def obter_indices_usuarios(self) -> "IndicesUsuarios":
+        """Retorna os índices acumulados por usuário (mantidos incrementalmente)"""
+        dados = self.obter()
+        if self.indices_usuarios is None:
+            self.indices_usuarios = IndicesUsuarios(dados.get("registros", []))
+        return self.indices_usuarios
+
+    def obter_indice_registros(self) -> IndiceRegistros:
+        """Retorna o índice de registros por ID (construído uma vez, depois mantido a cada mutação)"""
+        dados = self.obter()
+        if self.indice_registros is None:
+            self.indice_registros = IndiceRegistros(dados.setdefault("registros", []))
+        return self.indice_registros
+
+    def obter_ranking(self, periodo_tipo: str) -> "RankingPeriodo":
+        """Retorna o ranking incremental do período atual ("semanal" ou "mensal")"""
+        rollup = self.obter_rollup()
+        ranking = self.rankings.get(periodo_tipo)
+        if ranking is None:
+            ranking = self.rankings[periodo_tipo] = RankingPeriodo(periodo_tipo, rollup)
+        elif not ranking.periodo_vigente():
+            ranking.reiniciar(rollup)
+        return ranking
+
+    def observar(self, antes: Optional[Dict[str, Any]], depois: Optional[Dict[str, Any]]):
+        """Propaga a mudança de um registro para os índices derivados"""
+        if self.rollup is not None:
+            self.rollup.atualizar(antes, depois)
+        if self.indices_usuarios is not None:
+            self.indices_usuarios.atualizar(antes, depois)
+        for ranking in self.rankings.values():
+            ranking.atualizar(antes, depois)
+        if self.colunas is not None:
+            if antes is None and depois is not None:
+                self.colunas.adicionar(depois)
+            else:
+                self.colunas = None
+
+    async def registrar(self, mutacoes: List[Dict[str, Any]]) -> bool:
+        """Aplica as mutações nos dados residentes e as persiste, em ordem (substituições incluídas)"""
+        sucesso = True
+        inicio = 0
+        for posicao, mutacao in enumerate(mutacoes):
+            if mutacao["op"] == "substituir":
+                sucesso = await self.gravar_mutacoes(mutacoes[inicio:posicao]) and sucesso
+                sucesso = await self.substituir(mutacao["dados"]) and sucesso
+                inicio = posicao + 1
+        return await self.gravar_mutacoes(mutacoes[inicio:]) and sucesso
+
+    async def gravar_mutacoes(self, mutacoes: List[Dict[str, Any]]) -> bool:
+        """Aplica as mutações e as persiste (journal gravado em uma thread); desfaz na memória se a gravação falhar"""
+        if not mutacoes:
+            return True
+        armazenamento = obter_armazenamento()
+        indice = self.obter_indice_registros()
+        dados = self.obter()
+        
+        # Estado anterior de cada registro e chave de estado afetados, para desfazer o lote
+        alteracoes = []
+        def observar(antes, depois):
+            alteracoes.append((antes, dict(depois) if depois is not None else None))
+            self.observar(antes, depois)
+        estados = {mutacao["chave"]: dict(dados[mutacao["chave"]]) if mutacao["chave"] in dados else None
+                   for mutacao in mutacoes if mutacao["op"] == "estado"}
+        
+        # O journal recebe as mutações concretas (descontos já resolvidos), para o replay ser exato
+        mutacoes = aplicar_mutacoes(dados, mutacoes, observar, indice)
+        self.versao += 1
+        
+        if armazenamento.usa_journal:
+            self.gravacoes_pendentes += 1
+            try:
+                sucesso = await asyncio.get_running_loop().run_in_executor(
+                    None, armazenamento.registrar, dados, mutacoes, self.guild_id
+                )
+            finally:
+                self.gravacoes_pendentes -= 1
+        else:
+            sucesso = armazenamento.registrar(dados, mutacoes, self.guild_id)
+        self.assinatura = armazenamento.assinatura(self.guild_id)
+        
+        if not sucesso:
+            # Quem enfileirou recebe False: a mudança não pode sobreviver na memória (nem na próxima compactação)
+            self.desfazer(dados, alteracoes, estados)
+            return False
+        
+        if armazenamento.usa_journal:
+            self.sujo = True
+        self.mutacoes_desde_backup += len(mutacoes)
+        self.talvez_fazer_backup()
+        self.talvez_descarregar()
         return True
+
+    def desfazer(self, dados: Dict[str, Any], alteracoes: List[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]],
+                 estados: Dict[str, Optional[Dict[str, Any]]]):
+        """Reverte um lote aplicado (na ordem inversa), mantendo os índices derivados coerentes"""
+        inversas = []
+        for antes, depois in reversed(alteracoes):
+            if antes is None:
+                inversas.append({"op": "remover", "ids": [depois["id"]]})
+            else:
+                inversas.append({"op": "adicionar", "registro": antes})  # Recria ou sobrescreve por inteiro
+        aplicar_mutacoes(dados, inversas, self.observar, self.obter_indice_registros())
+        for chave, valor in estados.items():
+            if valor is None:
+                dados.pop(chave, None)
+            else:
+                dados[chave] = valor
+        self.versao += 1
+
+    def talvez_descarregar(self):
+        """Grava o snapshot se o intervalo de flush passou ou o journal ficou grande"""
+        if not self.sujo:
+            return
+        vencido = dt.datetime.now() - self.ultimo_flush >= dt.timedelta(seconds=INTERVALO_FLUSH_SEGUNDOS)
+        if vencido or obter_armazenamento().tamanho_journal(self.guild_id) >= LIMITE_JOURNAL_BYTES:
+            self.descarregar()
+
+    def descarregar(self) -> Optional[asyncio.Future]:
+        """Incorpora o journal em um novo snapshot, gravado em segundo plano"""
+        if self.compactacao is not None and not self.compactacao.done():
+            return None  # Compactação anterior ainda em andamento
         
-    except Exception as e:
-        print(f"❌ Erro ao salvar horas no arquivo {arquivo_horas}: {e}")
-        return False
+        armazenamento = obter_armazenamento()
+        futuro = armazenamento.compactar(self.dados, self.guild_id)
+        if futuro is None:
+            return None
+        
+        self.sujo = False
+        self.ultimo_flush = dt.datetime.now()
+        self.gravacoes_pendentes += 1
+        
+        def concluida(futuro_concluido):
+            self.gravacoes_pendentes -= 1
+            self.assinatura = armazenamento.assinatura(self.guild_id)
+            if futuro_concluido.cancelled() or not futuro_concluido.result():
+                self.sujo = True  # O journal selado continua no disco; a próxima descarga tenta de novo
+        
+        futuro.add_done_callback(concluida)
+        self.compactacao = futuro
+        return futuro
+
+    def talvez_fazer_backup(self, forcar: bool = False) -> Optional[asyncio.Future]:
+        """Dispara um backup em segundo plano se o intervalo ou o número de mutações foi atingido"""
+        if self.backup is not None and not self.backup.done():
+            return None  # Backup anterior ainda em andamento; as mutações entram no próximo
+        
+        agora = dt.datetime.now()
+        if self.ultimo_backup is None:
+            backups = listar_backups(self.guild_id)
+            self.ultimo_backup = backups[0][1] if backups else dt.datetime.min
+        
+        decorrido = agora - self.ultimo_backup
+        vencido = decorrido >= dt.timedelta(minutes=BACKUP_INTERVALO_MINUTOS)
+        muitas_mutacoes = (self.mutacoes_desde_backup >= BACKUP_MUTACOES
+                           and decorrido >= dt.timedelta(seconds=BACKUP_INTERVALO_MINIMO_SEGUNDOS))
+        if not (forcar or vencido or muitas_mutacoes):
+            return None
+        
+        # Copia agora (dados consistentes); serialização, compressão e rotação ficam na thread
+        copia = copiar_dados(self.obter())
+        self.ultimo_backup = agora
+        self.mutacoes_desde_backup = 0
+        try:
+            self.backup = asyncio.get_running_loop().run_in_executor(None, gravar_backup, copia, self.guild_id)
+        except RuntimeError:
+            gravar_backup(copia, self.guild_id)
+            return None
+        return self.backup
+
+    async def substituir(self, dados: Dict[str, Any]) -> bool:
+        """Substitui os dados residentes e grava um snapshot completo (chamado só pelo escritor do servidor)"""
+        # Uma compactação anterior gravaria o snapshot antigo por cima do restaurado
+        if self.compactacao is not None and not self.compactacao.done():
+            await asyncio.wait([self.compactacao])
+        
+        # Guardar o estado atual antes de substituí-lo; sem essa cópia a restauração não prossegue
+        if self.backup is not None and not self.backup.done():
+            await asyncio.wait([self.backup])
+        backup = self.talvez_fazer_backup(forcar=True)
+        if backup is None or not await backup:
+            print(f"❌ Restauração cancelada: não foi possível salvar o estado atual ({obter_arquivo_horas(self.guild_id)})")
+            return False
+        
+        armazenamento = obter_armazenamento()
+        dados.pop("mensagens_ids", None)
+        self.dados = dados
+        self.versao += 1
+        self.limpar_indices()
+        
+        if armazenamento.usa_journal:
+            self.gravacoes_pendentes += 1
+            try:
+                sucesso = await asyncio.get_running_loop().run_in_executor(
+                    None, armazenamento.salvar, dados, self.guild_id
+                )
+            finally:
+                self.gravacoes_pendentes -= 1
+        else:
+            sucesso = armazenamento.salvar(dados, self.guild_id)
+        self.assinatura = armazenamento.assinatura(self.guild_id)
+        # O snapshot já descartou o journal; se falhou, a próxima descarga grava os dados restaurados
+        self.sujo = not sucesso
+        self.ultimo_flush = dt.datetime.now()
+        return sucesso
+
+_stores: Dict[Optional[int], HorasStore] = {}
+
+def obter_store(guild_id: int = None) -> HorasStore:
+    """Retorna o store residente do servidor (criado na primeira chamada)"""
+    if guild_id not in _stores:
+        _stores[guild_id] = HorasStore(guild_id)
+    return _stores[guild_id]
+
+def obter_store_dos_dados(dados: Dict[str, Any]) -> Optional[HorasStore]:
+    """Encontra o store residente dono deste dicionário de dados (se houver)"""
+    for store in _stores.values():
+        if store.dados is dados:
+            return store
+    return None
+
+def versao_dados(guild_id: int = None) -> int:
+    """Versão atual dos dados do servidor (muda a cada alteração)"""
+    store = obter_store(guild_id)
+    store.obter()
+    return store.versao
+
+async def registrar_mutacoes(mutacoes: List[Dict[str, Any]], guild_id: int = None) -> bool:
+    """Aplica as mutações nos dados residentes do servidor e as persiste"""
+    return await obter_store(guild_id).registrar(mutacoes)
+
+class EscritorMutacoes:
+    """Escritor único de um servidor: aplica as mutações em ordem e agrupa as próximas em um commit"""
+
+    def __init__(self, guild_id: int = None):
+        self.guild_id = guild_id
+        self.fila: asyncio.Queue = asyncio.Queue()
+        self.tarefa: Optional[asyncio.Task] = None
+
+    def enviar(self, mutacoes: List[Dict[str, Any]]) -> asyncio.Future:
+        """Enfileira as mutações; o future resolve com o sucesso da gravação"""
+        futuro = asyncio.get_running_loop().create_future()
+        self.fila.put_nowait((mutacoes, futuro))
+        if self.tarefa is None or self.tarefa.done():
+            self.tarefa = asyncio.create_task(self.executar(), name=f"escritor:{self.guild_id}")
+        return futuro
+
+    async def executar(self):
+        """Consome a fila, gravando cada lote de mutações de uma vez"""
+        while True:
+            try:
+                lote = [await asyncio.wait_for(self.fila.get(), timeout=INTERVALO_FLUSH_SEGUNDOS)]
+            except asyncio.TimeoutError:
+                # Fila ociosa: levar ao snapshot o que ficou só no journal
+                store = obter_store(self.guild_id)
+                if store.sujo:
+                    store.descarregar()
+                continue
+            
+            # Aguardar a janela para juntar as mutações que chegarem em seguida
+            await asyncio.sleep(JANELA_GROUP_COMMIT)
+            while not self.fila.empty():
+                lote.append(self.fila.get_nowait())
+            
+            # Uma substituição (restauração) vira um commit à parte: cada pedido recebe o resultado do seu
+            grupos: List[Tuple[bool, list]] = []
+            for pedido in lote:
+                restauracao = any(mutacao["op"] == "substituir" for mutacao in pedido[0])
+                if restauracao or not grupos or grupos[-1][0]:
+                    grupos.append((restauracao, [pedido]))
+                else:
+                    grupos[-1][1].append(pedido)
+            
+            for _, grupo in grupos:
+                mutacoes = [mutacao for pedido, _ in grupo for mutacao in pedido]
+                try:
+                    sucesso = await registrar_mutacoes(mutacoes, self.guild_id)
+                except Exception as e:
+                    print(f"❌ Erro ao gravar {len(mutacoes)} mutações ({obter_arquivo_horas(self.guild_id)}): {e}")
+                    sucesso = False
+                
+                for _, futuro in grupo:
+                    if not futuro.done():
+                        futuro.set_result(sucesso)
+                    self.fila.task_done()
+
+_escritores: Dict[Optional[int], EscritorMutacoes] = {}
+
+async def enfileirar_mutacoes(mutacoes: List[Dict[str, Any]], guild_id: int = None) -> bool:
+    """Envia as mutações ao escritor do servidor e aguarda até estarem persistidas"""
+    if not mutacoes:
+        return True
+    if guild_id not in _escritores:
+        _escritores[guild_id] = EscritorMutacoes(guild_id)
+    return await _escritores[guild_id].enviar(mutacoes)
+
+async def descarregar_tudo():
+    """Esvazia as filas de escrita e grava o snapshot de todos os servidores (usado no desligamento)"""
+    for escritor in list(_escritores.values()):
+        if escritor.tarefa and not escritor.tarefa.done():
+            await escritor.fila.join()
+    
+    for store in list(_stores.values()):
+        # Uma compactação em andamento precisa terminar antes de selar o journal de novo
+        if store.compactacao and not store.compactacao.done():
+            await store.compactacao
+        if store.sujo:
+            futuro = store.descarregar()
+            if futuro:
+                await futuro
+    print("💾 Dados gravados em disco")
+
+# --- Funções utilitárias ---
+def carregar_horas(guild_id: int = None) -> Dict[str, Any]:
+    """Retorna os dados de horas residentes do servidor (sem reler o arquivo)"""
+    return obter_store(guild_id).obter()
+
+async def salvar_horas(dados: Dict[str, Any], guild_id: int = None) -> bool:
+    """Substitui os dados de horas do servidor por um snapshot completo (em ordem com as demais mutações)"""
+    return await enfileirar_mutacoes([{"op": "substituir", "dados": dados}], guild_id)
+
+def obter_indice_mensagens(dados: Dict[str, Any]) -> Set[int]:
+    """Conjunto residente de IDs de mensagens já importadas (busca O(1)); não deve ser alterado por quem chama"""
+    store = obter_store_dos_dados(dados)
+    if store:
+        return store.obter_indice_registros().mensagens
+    return {registro["mensagem_id"] for registro in dados.get("registros", []) if registro.get("mensagem_id")}
+
+def mensagem_importada(dados: Dict[str, Any], mensagem_id: int) -> bool:
+    """Indica se a mensagem já virou registro"""
+    return mensagem_id in obter_indice_mensagens(dados)
+
+def criar_registro_mensagem(mensagem_id: int, data: str, nome_usuario: str, tempo_horas: float) -> Dict[str, Any]:
+    """Monta o registro de horas de uma mensagem do Nyox (dados do servidor ficam em dados["servidor"])"""
+    registro = {
+        "id": f"m{mensagem_id}",
+        "data": data,
+        "nome": nome_usuario,
+        "horas": tempo_horas,
+        "mensagem_id": mensagem_id,
+        "processado_em": dt.datetime.now().isoformat()
+    }
+    usuario_id = extrair_id_usuario(nome_usuario)
+    if usuario_id:
+        registro["usuario_id"] = usuario_id
+    return registro
 
 def carregar_configuracoes(guild_id: int = None) -> Dict[str, Any]:
     """Carrega as configurações do bot específicas do servidor"""
@@ -154,7 +1582,8 @@ def carregar_configuracoes(guild_id: int = None) -> Dict[str, Any]:
         "admin_users": [],
         "auto_update": {"ativo": True, "intervalo_minutos": 5, "ultima_atualizacao": None},
         "leaderboard_update": {"ativo": True, "intervalo_horas": 1, "ultima_atualizacao": None},
-        "log_channel": None
+        "log_channel": None,
+        "leaderboard_mensagens": {}
     }
     
     try:
@@ -221,75 +1650,382 @@ def obter_periodo_mensal() -> Tuple[dt.date, dt.date]:
         ultimo_dia = hoje.replace(month=hoje.month + 1, day=1) - dt.timedelta(days=1)
     return primeiro_dia, ultimo_dia
 
-def agrupar_horas_por_periodo(dados: Dict[str, Any], data_inicio: dt.date, data_fim: dt.date) -> List[Tuple[str, float]]:
-    """Agrupa horas por usuário dentro de um período específico"""
-    horas_consolidadas = {}
-    
-    for registro in dados.get("registros", []):
+# --- Motor colunar de agregação ---
+class ColunasRegistros:
+    """Forma colunar compacta dos registros: dia ordinal, usuário internado, horas e origem"""
+
+    ORIGEM_NYOX = 0
+    ORIGEM_MANUAL = 1
+
+    def __init__(self):
+        self.dias = array("i")       # date.toordinal()
+        self.usuarios = array("i")   # índice em self.nomes
+        self.horas = array("d")
+        self.origens = array("b")    # ORIGEM_NYOX / ORIGEM_MANUAL
+        self.nomes: List[Any] = []            # chave_usuario de cada usuário
+        self.indice_nomes: Dict[Any, int] = {}
+        self._ordinais: Dict[str, int] = {}
+
+    @classmethod
+    def de_registros(cls, registros: List[Dict[str, Any]]) -> "ColunasRegistros":
+        """Converte a lista de registros para a forma colunar (registros inválidos são ignorados)"""
+        colunas = cls()
+        for registro in registros:
+            colunas.adicionar(registro)
+        return colunas
+
+    def adicionar(self, registro: Dict[str, Any]):
+        """Acrescenta um registro às colunas"""
         try:
-            data_registro = dt.datetime.strptime(registro["data"], "%Y-%m-%d").date()
-            if data_inicio <= data_registro <= data_fim:
-                nome_usuario = normalizar_nome_usuario(registro["nome"])
-                horas_consolidadas[nome_usuario] = horas_consolidadas.get(nome_usuario, 0.0) + registro["horas"]
+            data = registro["data"]
+            dia = self._ordinais.get(data)
+            if dia is None:
+                dia = self._ordinais[data] = dt.date.fromisoformat(data).toordinal()
+            horas = float(registro["horas"])
+            nome = chave_usuario(registro)
         except Exception:
-            continue
+            return
+        
+        usuario = self.indice_nomes.get(nome)
+        if usuario is None:
+            usuario = self.indice_nomes[nome] = len(self.nomes)
+            self.nomes.append(nome)
+        
+        self.dias.append(dia)
+        self.usuarios.append(usuario)
+        self.horas.append(horas)
+        self.origens.append(self.ORIGEM_MANUAL if registro.get("adicionado_manual") else self.ORIGEM_NYOX)
+
+    def somar_por_usuario(self, data_inicio: dt.date, data_fim: dt.date = None) -> List[float]:
+        """Soma as horas de cada usuário no intervalo de dias (operação em lote sobre as colunas)"""
+        inicio = data_inicio.toordinal()
+        fim = data_fim.toordinal() if data_fim else 2 ** 31 - 1
+        
+        dias = np.frombuffer(self.dias, dtype=np.int32)
+        mascara = (dias >= inicio) & (dias <= fim)
+        return np.bincount(
+            np.frombuffer(self.usuarios, dtype=np.int32)[mascara],
+            weights=np.frombuffer(self.horas, dtype=np.float64)[mascara],
+            minlength=len(self.nomes)
+        ).tolist()
+
+    def ranking(self, data_inicio: dt.date, data_fim: dt.date = None, limite: int = None) -> List[Tuple[str, float]]:
+        """Ranking (ou top-K, com limite) de horas por usuário no intervalo"""
+        somas = self.somar_por_usuario(data_inicio, data_fim)
+        candidatos = ((self.nomes[usuario], horas) for usuario, horas in enumerate(somas) if horas > 1e-9)
+        if limite is not None:
+            return heapq.nlargest(limite, candidatos, key=lambda x: x[1])
+        return sorted(candidatos, key=lambda x: x[1], reverse=True)
+
+# --- Rollup diário ---
+class RollupDiario:
+    """Totais de horas por usuário e por dia, atualizados a cada registro adicionado/alterado/removido"""
+
+    def __init__(self, registros: List[Dict[str, Any]] = ()):
+        self.horas: Dict[Any, Dict[str, float]] = {}  # chave do usuário -> data -> horas
+        self.data_maxima = ""
+        for registro in registros:
+            self.ajustar(registro, 1)
+
+    def ajustar(self, registro: Dict[str, Any], sinal: int):
+        """Soma (sinal=1) ou subtrai (sinal=-1) as horas de um registro"""
+        try:
+            usuario = chave_usuario(registro)
+            data = registro["data"]
+            horas = float(registro["horas"])
+        except Exception:
+            return
+        
+        dias = self.horas.setdefault(usuario, {})
+        total = dias.get(data, 0.0) + sinal * horas
+        if abs(total) < 1e-9:
+            dias.pop(data, None)
+            if not dias:
+                del self.horas[usuario]
+        else:
+            dias[data] = total
+        if data > self.data_maxima:
+            self.data_maxima = data
+
+    def atualizar(self, antes: Optional[Dict[str, Any]], depois: Optional[Dict[str, Any]]):
+        """Observador de mutações: aplica a diferença entre as versões do registro"""
+        if antes is not None:
+            self.ajustar(antes, -1)
+        if depois is not None:
+            self.ajustar(depois, 1)
+
+    def janela(self, data_inicio: dt.date, data_fim: dt.date = None) -> List[str]:
+        """Lista as datas (YYYY-MM-DD) do período; sem fim, vai até o último dia com registro"""
+        if data_fim is None:
+            data_fim = max(dt.date.today(), dt.date.fromisoformat(self.data_maxima) if self.data_maxima else data_inicio)
+        return [
+            (data_inicio + dt.timedelta(days=i)).strftime("%Y-%m-%d")
+            for i in range((data_fim - data_inicio).days + 1)
+        ]
+
+    def somar(self, dias: Dict[str, float], datas: List[str], data_inicio: str, data_fim: str) -> float:
+        """Soma as horas de um usuário nas datas do período (percorre o menor dos dois)"""
+        if len(dias) < len(datas):
+            return sum(horas for data, horas in dias.items() if data_inicio <= data <= data_fim)
+        return sum(dias.get(data, 0.0) for data in datas)
+
+    def ranking_periodo(self, data_inicio: dt.date, data_fim: dt.date = None) -> List[Tuple[str, float]]:
+        """Ranking de horas por usuário no período, em O(usuários × dias do período)"""
+        datas = self.janela(data_inicio, data_fim)
+        if not datas:
+            return []
+        ranking = []
+        for usuario, dias in self.horas.items():
+            horas = self.somar(dias, datas, datas[0], datas[-1])
+            if horas > 1e-9:
+                ranking.append((usuario, horas))
+        ranking.sort(key=lambda x: x[1], reverse=True)
+        return ranking
+
+    def total_usuario(self, usuario, data_inicio: dt.date = None) -> float:
+        """Total de horas de um usuário pela chave (opcionalmente a partir de uma data)"""
+        dias = self.horas.get(usuario, {})
+        if data_inicio is None:
+            return sum(dias.values())
+        datas = self.janela(data_inicio)
+        if not datas:
+            return 0.0
+        return self.somar(dias, datas, datas[0], datas[-1])
+
+# --- Índice acumulado por usuário (Fenwick) ---
+class ArvoreFenwick:
+    """Árvore de Fenwick: atualização pontual e soma de prefixo em O(log n)"""
+
+    def __init__(self, tamanho: int):
+        self.arvore = [0.0] * (tamanho + 1)
+
+    def __len__(self) -> int:
+        return len(self.arvore) - 1
+
+    def somar_em(self, posicao: int, valor: float):
+        posicao += 1
+        while posicao < len(self.arvore):
+            self.arvore[posicao] += valor
+            posicao += posicao & -posicao
+
+    def prefixo(self, posicao: int) -> float:
+        """Soma das posições 0..posicao (inclusive)"""
+        posicao = min(posicao + 1, len(self.arvore) - 1)
+        total = 0.0
+        while posicao > 0:
+            total += self.arvore[posicao]
+            posicao -= posicao & -posicao
+        return total
+
+class IndiceUsuario:
+    """Horas e registros acumulados de um usuário por dia ordinal (consultas de intervalo em O(log n))"""
+
+    def __init__(self):
+        self.base = 0  # Ordinal do primeiro dia coberto pelas árvores
+        self.horas = ArvoreFenwick(0)
+        self.registros = ArvoreFenwick(0)
+        self.horas_dia: Dict[int, float] = {}
+        self.registros_dia: Dict[int, int] = {}
+        self.dias_ativos: List[int] = []  # Dias com horas, ordenados
+
+    def _cobrir(self, dia: int):
+        """Garante que as árvores cobrem o dia (reconstrói com o dobro do tamanho quando não)"""
+        if len(self.horas) and self.base <= dia < self.base + len(self.horas):
+            return
+        dias = list(self.horas_dia) + [dia]
+        inicio, fim = min(dias), max(dias)
+        tamanho = max(64, 2 * (fim - inicio + 1))
+        self.base = inicio - (tamanho - (fim - inicio + 1)) // 2
+        self.horas = ArvoreFenwick(tamanho)
+        self.registros = ArvoreFenwick(tamanho)
+        for d, horas in self.horas_dia.items():
+            self.horas.somar_em(d - self.base, horas)
+        for d, quantidade in self.registros_dia.items():
+            self.registros.somar_em(d - self.base, quantidade)
+
+    def ajustar(self, dia: int, horas: float, registros: int):
+        """Atualização pontual: soma horas/quantidade de registros em um dia"""
+        self._cobrir(dia)
+        self.horas.somar_em(dia - self.base, horas)
+        self.registros.somar_em(dia - self.base, registros)
+        
+        anterior = self.horas_dia.get(dia, 0.0)
+        total = anterior + horas
+        quantidade = self.registros_dia.get(dia, 0) + registros
+        if quantidade <= 0 and abs(total) < 1e-9:
+            self.horas_dia.pop(dia, None)
+            self.registros_dia.pop(dia, None)
+        else:
+            self.horas_dia[dia] = total
+            self.registros_dia[dia] = quantidade
+        
+        ativo_antes = abs(anterior) > 1e-9
+        ativo_depois = abs(total) > 1e-9
+        if ativo_depois and not ativo_antes:
+            bisect.insort(self.dias_ativos, dia)
+        elif ativo_antes and not ativo_depois:
+            posicao = bisect.bisect_left(self.dias_ativos, dia)
+            if posicao < len(self.dias_ativos) and self.dias_ativos[posicao] == dia:
+                del self.dias_ativos[posicao]
+
+    def _intervalo(self, arvore: ArvoreFenwick, inicio: int, fim: int) -> float:
+        if not len(arvore) or fim < self.base:
+            return 0.0
+        return arvore.prefixo(fim - self.base) - (arvore.prefixo(inicio - self.base - 1) if inicio > self.base else 0.0)
+
+    def total_horas(self, inicio: int, fim: int) -> float:
+        """Horas do usuário entre os dias ordinais inicio e fim (inclusive)"""
+        return self._intervalo(self.horas, inicio, fim)
+
+    def total_registros(self, inicio: int, fim: int) -> int:
+        """Quantidade de registros do usuário entre os dias ordinais inicio e fim"""
+        return round(self._intervalo(self.registros, inicio, fim))
+
+    def dias_no_intervalo(self, inicio: int, fim: int) -> List[int]:
+        """Dias com horas no intervalo, em ordem crescente"""
+        return self.dias_ativos[bisect.bisect_left(self.dias_ativos, inicio):bisect.bisect_right(self.dias_ativos, fim)]
+
+class IndicesUsuarios:
+    """Índices acumulados (Fenwick) de todos os usuários de um servidor"""
+
+    def __init__(self, registros: List[Dict[str, Any]] = ()):
+        self.usuarios: Dict[Any, IndiceUsuario] = {}
+        for registro in registros:
+            self.ajustar(registro, 1)
+
+    def ajustar(self, registro: Dict[str, Any], sinal: int):
+        """Soma (sinal=1) ou subtrai (sinal=-1) um registro"""
+        try:
+            dia = dt.date.fromisoformat(registro["data"]).toordinal()
+            horas = float(registro["horas"])
+            usuario = chave_usuario(registro)
+        except Exception:
+            return
+        self.usuarios.setdefault(usuario, IndiceUsuario()).ajustar(dia, sinal * horas, sinal)
+
+    def atualizar(self, antes: Optional[Dict[str, Any]], depois: Optional[Dict[str, Any]]):
+        """Observador de mutações: aplica a diferença entre as versões do registro"""
+        if antes is not None:
+            self.ajustar(antes, -1)
+        if depois is not None:
+            self.ajustar(depois, 1)
+
+    def resumo(self, chaves, data_inicio: dt.date, data_fim: dt.date = None) -> Tuple[float, int, Dict[str, float]]:
+        """Total de horas, quantidade de registros e horas por data de um usuário (chaves já resolvidas) no período"""
+        inicio = data_inicio.toordinal()
+        fim = data_fim.toordinal() if data_fim else dt.date.max.toordinal()
+        total = 0.0
+        registros = 0
+        horas_por_data: Dict[str, float] = {}
+        
+        for usuario in set(chaves):
+            indice = self.usuarios.get(usuario)
+            if indice is None:
+                continue
+            total += indice.total_horas(inicio, fim)
+            registros += indice.total_registros(inicio, fim)
+            for dia in indice.dias_no_intervalo(inicio, fim):
+                data = dt.date.fromordinal(dia).strftime("%Y-%m-%d")
+                horas_por_data[data] = horas_por_data.get(data, 0.0) + indice.horas_dia[dia]
+        
+        return total, registros, horas_por_data
+
+def agrupar_horas_por_periodo(dados: Dict[str, Any], data_inicio: dt.date, data_fim: dt.date) -> List[Tuple[str, float]]:
+    """Agrupa horas por usuário dentro de um período específico"""
+    store = obter_store_dos_dados(dados)
+    if store:
+        return store.obter_rollup().ranking_periodo(data_inicio, data_fim)
     
-    ranking = [(nome, horas) for nome, horas in horas_consolidadas.items() if horas > 0]
-    ranking.sort(key=lambda x: x[1], reverse=True)
-    return ranking
+    return ColunasRegistros.de_registros(dados.get("registros", [])).ranking(data_inicio, data_fim)
 
 def agrupar_horas_por_usuario(dados: Dict[str, Any], dias: int = 30) -> List[Tuple[str, float]]:
     """Agrupa todas as horas por usuário"""
     data_limite = (dt.datetime.now() - dt.timedelta(days=dias)).date()
     
-    horas_consolidadas = {}
-    
-    for registro in dados.get("registros", []):
-        data_registro = dt.datetime.strptime(registro["data"], "%Y-%m-%d").date()
-        if data_registro >= data_limite:
-            nome_usuario = normalizar_nome_usuario(registro["nome"])
-            if nome_usuario not in horas_consolidadas:
-                horas_consolidadas[nome_usuario] = 0.0
-            horas_consolidadas[nome_usuario] += registro["horas"]
-    
-    ranking = [(nome, horas) for nome, horas in horas_consolidadas.items() if horas > 0]
-    ranking.sort(key=lambda x: x[1], reverse=True)
+    store = obter_store_dos_dados(dados)
+    if store:
+        # Janelas longas: varredura vetorizada das colunas é mais barata que dia a dia no rollup
+        if dias > JANELA_MAXIMA_ROLLUP:
+            return store.obter_colunas().ranking(data_limite)
+        return store.obter_rollup().ranking_periodo(data_limite)
     
-    return ranking
+    return ColunasRegistros.de_registros(dados.get("registros", [])).ranking(data_limite)
+
+# --- Cache de nomes de membros ---
+class CacheNomesMembros:
+    """Nomes de exibição por (servidor, ID) com validade, alimentado por eventos e consultas em lote"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.nomes: Dict[int, Dict[int, Tuple[str, float]]] = {}  # servidor -> ID -> (nome, expira_em)
+
+    def obter(self, guild_id: int, user_id: int) -> Optional[str]:
+        """Nome em cache, mesmo vencido ("" = não é membro; None = desconhecido)"""
+        entrada = self.nomes.get(guild_id, {}).get(user_id)
+        return entrada[0] if entrada else None
 
-def obter_nome_amigavel(nome: str, guild: discord.Guild = None) -> str:
-    """Tenta obter um nome amigável para o usuário"""
+    def definir(self, guild_id: int, user_id: int, nome: str) -> bool:
+        """Guarda o nome do membro; retorna True se ele mudou"""
+        servidor = self.nomes.setdefault(guild_id, {})
+        anterior = servidor.get(user_id)
+        servidor[user_id] = (nome, time.monotonic() + self.ttl)
+        return anterior is None or anterior[0] != nome
+
+    def expirar_usuario(self, user_id: int):
+        """Marca o usuário como vencido em todos os servidores (será consultado de novo)"""
+        for servidor in self.nomes.values():
+            if user_id in servidor:
+                servidor[user_id] = (servidor[user_id][0], 0.0)
+
+    def pendentes(self, guild_id: int, ids) -> List[int]:
+        """IDs sem nome em cache ou com nome vencido"""
+        agora = time.monotonic()
+        servidor = self.nomes.get(guild_id, {})
+        return [user_id for user_id in ids if user_id not in servidor or servidor[user_id][1] <= agora]
+
+_nomes_membros = CacheNomesMembros(TTL_NOMES_MEMBROS)
+
+def obter_nome_membro(guild: discord.Guild, user_id: int) -> str:
+    """Nome de exibição do membro pelo cache de nomes ou pelo cache local; nunca consulta a API"""
+    nome = _nomes_membros.obter(guild.id, user_id)
+    if nome is None:
+        member = guild.get_member(user_id)
+        if member:
+            nome = member.display_name
+            _nomes_membros.definir(guild.id, user_id, nome)
+    return nome or f"Usuário {user_id}"
+
+def obter_nome_amigavel(nome, guild: discord.Guild = None) -> str:
+    """Tenta obter um nome amigável para o usuário (chave inteira ou texto)"""
+    if isinstance(nome, int):
+        return obter_nome_membro(guild, nome) if guild else f"Usuário {nome}"
+    
     if nome.startswith('<@') and nome.endswith('>') and nome[2:-1].isdigit():
         user_id = int(nome[2:-1])
         if guild:
-            member = guild.get_member(user_id)
-            if member:
-                return member.display_name
+            return obter_nome_membro(guild, user_id)
         return f"Usuário {user_id}"
     
     if nome.isdigit() and len(nome) > 10:
         user_id = int(nome)
         if guild:
-            member = guild.get_member(user_id)
-            if member:
-                return member.display_name
+            return obter_nome_membro(guild, user_id)
         return f"Usuário {user_id}"
     
     return nome
 
-def calcular_total_horas_usuario(dados: Dict[str, Any], usuario_identificador: str, dias: int = None) -> float:
+def calcular_total_horas_usuario(dados: Dict[str, Any], usuario_identificador, dias: int = None) -> float:
     """Calcula o total de horas de um usuário"""
-    total = 0.0
-    identificadores = [usuario_identificador]
+    store = obter_store_dos_dados(dados)
+    if store:
+        data_limite = (dt.datetime.now() - dt.timedelta(days=dias)).date() if dias is not None else None
+        return store.obter_rollup().total_usuario(resolver_usuario(dados, usuario_identificador), data_limite)
     
-    if usuario_identificador.startswith('<@') and usuario_identificador.endswith('>'):
-        user_id = usuario_identificador[2:-1]
-        identificadores.extend([user_id, f"@{user_id}"])
-    elif usuario_identificador.isdigit():
-        identificadores.extend([f"<@{usuario_identificador}>", f"@{usuario_identificador}"])
+    total = 0.0
+    chave = resolver_usuario(dados, usuario_identificador)
     
     for registro in dados.get("registros", []):
-        if registro["nome"] in identificadores:
+        if chave_usuario(registro) == chave:
             if dias is not None:
                 data_registro = dt.datetime.strptime(registro["data"], "%Y-%m-%d").date()
                 data_limite = (dt.datetime.now() - dt.timedelta(days=dias)).date()
@@ -403,7 +2139,25 @@ async def criar_embed_leaderboard(dados: Dict[str, Any], dias: int, interaction:
     
     return embed
 
+# Último embed renderizado por (servidor, período), com a chave de versão usada
+_cache_embeds: Dict[Tuple[int, str], Tuple[Tuple, discord.Embed]] = {}
+
 async def criar_embed_leaderboard_completo(dados: Dict[str, Any], periodo_tipo: str, interaction: discord.Interaction) -> discord.Embed:
+    """Retorna o embed do leaderboard, reaproveitando o último se dados e membros não mudaram"""
+    store = obter_store_dos_dados(dados)
+    if not store:
+        return await renderizar_leaderboard_completo(dados, periodo_tipo, interaction)
+    
+    chave_versao = (obter_periodo(periodo_tipo), store.versao, bot.versao_membros)
+    em_cache = _cache_embeds.get((interaction.guild.id, periodo_tipo))
+    if em_cache and em_cache[0] == chave_versao:
+        return em_cache[1]
+    
+    embed = await renderizar_leaderboard_completo(dados, periodo_tipo, interaction)
+    _cache_embeds[(interaction.guild.id, periodo_tipo)] = (chave_versao, embed)
+    return embed
+
+async def renderizar_leaderboard_completo(dados: Dict[str, Any], periodo_tipo: str, interaction: discord.Interaction) -> discord.Embed:
     """Cria o embed do leaderboard no formato completo com Ranking 1 e Ranking 2"""
     if periodo_tipo == "semanal":
         data_inicio, data_fim = obter_periodo_semanal()
@@ -414,7 +2168,17 @@ async def criar_embed_leaderboard_completo(dados: Dict[str, Any], periodo_tipo:
         titulo = "Leaderboard de Horários"
         periodo_texto = f"**Período**: {data_inicio.strftime('%d/%m/%Y')} até {data_fim.strftime('%d/%m/%Y')}"
 
-    ranking = agrupar_horas_por_periodo(dados, data_inicio, data_fim)
+    store = obter_store_dos_dados(dados)
+    if store:
+        # Ranking incremental: apenas as 100 primeiras posições, sem ordenar tudo de novo
+        classificacao = store.obter_ranking(periodo_tipo)
+        ranking = classificacao.top(100)
+        total_horas = classificacao.total
+        total_participantes = len(classificacao)
+    else:
+        ranking = agrupar_horas_por_periodo(dados, data_inicio, data_fim)
+        total_horas = sum(horas for _, horas in ranking)
+        total_participantes = len(ranking)
     
     if not ranking:
         embed = discord.Embed(
@@ -423,9 +2187,6 @@ async def criar_embed_leaderboard_completo(dados: Dict[str, Any], periodo_tipo:
             color=discord.Color.orange()
         )
         return embed
-
-    total_horas = sum(horas for _, horas in ranking)
-    total_participantes = len(ranking)
     
     # Formatar total de horas para alinhar casas decimais
     total_horas_str = f"{total_horas:.1f}h"
@@ -485,6 +2246,99 @@ async def criar_embed_leaderboard_completo(dados: Dict[str, Any], periodo_tipo:
     embed.set_footer(text=f"Atualizado em {dt.datetime.now().strftime('%d/%m/%Y %H:%M')}")
     return embed
 
+def calcular_hash_embed(embed: discord.Embed) -> str:
+    """Hash do conteúdo do embed, ignorando rodapé e horário de atualização"""
+    conteudo = embed.to_dict()
+    conteudo.pop("footer", None)
+    conteudo.pop("timestamp", None)
+    return hashlib.sha256(json.dumps(conteudo, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+async def limpar_mensagens_antigas(canal: discord.TextChannel, guild: discord.Guild, manter: Set[int]):
+    """Apaga mensagens antigas do bot no canal de leaderboard (em lote quando possível)"""
+    limite_lote = discord.utils.utcnow() - dt.timedelta(days=14)
+    pode_gerenciar = canal.permissions_for(guild.me).manage_messages
+    
+    antigas = [
+        message async for message in canal.history(limit=10)
+        if message.author.id == guild.me.id and message.id not in manter
+    ]
+    if not antigas:
+        return
+    
+    # O endpoint de exclusão em lote só aceita mensagens com menos de 14 dias
+    em_lote = [message for message in antigas if pode_gerenciar and message.created_at > limite_lote]
+    individuais = [message for message in antigas if message not in em_lote]
+    
+    try:
+        if em_lote:
+            await canal.delete_messages(em_lote)
+        for message in individuais:
+            await message.delete()
+        print(f"🗑️ {len(antigas)} mensagens antigas apagadas em #{canal.name}")
+    except Exception as e:
+        print(f"⚠️ Erro ao limpar mensagens em #{canal.name}: {e}")
+
+async def publicar_leaderboard(guild: discord.Guild, canal_id: int, periodo_tipo: str, dados: Dict[str, Any], interaction) -> None:
+    """Edita a mensagem de leaderboard do período (ou envia uma nova), pulando quando nada mudou"""
+    if not canal_id:
+        print(f"❌ ID do canal {periodo_tipo} não configurado")
+        return
+    
+    canal = guild.get_channel(canal_id)
+    if not canal:
+        print(f"❌ Canal {periodo_tipo} não encontrado (ID: {canal_id})")
+        return
+    
+    permissões = canal.permissions_for(guild.me)
+    if not permissões.send_messages:
+        print(f"❌ Bot sem permissão para enviar mensagens em #{canal.name}")
+        return
+    
+    try:
+        embed = await criar_embed_leaderboard_completo(dados, periodo_tipo, interaction)
+    except Exception as e:
+        print(f"❌ Erro ao criar embed {periodo_tipo}: {e}")
+        return
+    
+    config = carregar_configuracoes(guild.id)
+    mensagens = config.setdefault("leaderboard_mensagens", {})
+    publicada = mensagens.get(periodo_tipo) or {}
+    hash_embed = calcular_hash_embed(embed)
+    
+    mensagem_id = publicada.get("mensagem_id") if publicada.get("canal_id") == canal.id else None
+    if mensagem_id and publicada.get("hash") == hash_embed:
+        print(f"⏭️ Leaderboard {periodo_tipo} sem mudanças em #{canal.name}, nada a enviar")
+        return
+    
+    mensagem = None
+    if mensagem_id:
+        try:
+            mensagem = await canal.get_partial_message(mensagem_id).edit(embed=embed)
+            print(f"✏️ Leaderboard {periodo_tipo} editada (Mensagem ID: {mensagem_id})")
+        except discord.NotFound:
+            print(f"⚠️ Mensagem de leaderboard {periodo_tipo} não existe mais, enviando nova...")
+        except discord.HTTPException as e:
+            print(f"❌ ERRO HTTP ao editar leaderboard {periodo_tipo}: {e}")
+            return
+    
+    if mensagem is None:
+        try:
+            mensagem = await canal.send(embed=embed)
+            print(f"✅ Leaderboard {periodo_tipo} ENVIADA COM SUCESSO! Mensagem ID: {mensagem.id}")
+        except discord.Forbidden:
+            print(f"❌ ERRO DE PERMISSÃO: Bot não pode enviar mensagens em #{canal.name}")
+            return
+        except discord.HTTPException as e:
+            print(f"❌ ERRO HTTP ao enviar: {e}")
+            return
+        
+        # Remover leaderboards antigas, preservando as mensagens atuais de todos os períodos
+        manter = {info.get("mensagem_id") for info in mensagens.values() if info} | {mensagem.id}
+        await limpar_mensagens_antigas(canal, guild, manter)
+    
+    mensagens[periodo_tipo] = {"canal_id": canal.id, "mensagem_id": mensagem.id, "hash": hash_embed}
+    salvar_configuracoes(config, guild.id)
+
 async def atualizar_leaderboards_automaticamente(guild: discord.Guild):
     """Atualiza automaticamente os canais de leaderboard - VERSÃO COMPLETA CORRIGIDA"""
     try:
@@ -492,19 +2346,15 @@ async def atualizar_leaderboards_automaticamente(guild: discord.Guild):
         
         # Carregar configurações específicas do servidor
         server_config = get_server_config(guild.id)
-        CATEGORIA_ID = server_config["CATEGORIA_ID"]
         
-        # Processar dados PRIMEIRO
+        # Processar dados PRIMEIRO (reaproveita uma ingestão recente ou em andamento)
         print(f"📊 Processando dados ANTES das leaderboards...")
-        dados_processados = await bot.processar_categoria(guild, CATEGORIA_ID, limite=100)
+        dados_processados = await bot.ingerir(guild, limite=100)
         
         if not dados_processados:
             print(f"❌ Falha no processamento de dados para {guild.name}")
             return
         
-        # AGUARDAR para garantir que os dados estão salvos
-        await asyncio.sleep(2)
-        
         # CORREÇÃO: Carregar dados do arquivo específico do servidor
         dados = carregar_horas(guild.id)  # ← CORREÇÃO AQUI
         total_registros = len(dados.get("registros", []))
@@ -528,108 +2378,9 @@ async def atualizar_leaderboards_automaticamente(guild: discord.Guild):
         
         fake_interaction = FakeInteraction(guild)
 
-        # ATUALIZAR LEADERBOARD SEMANAL
-        if CANAL_LEADERBOARD_SEMANAL:
-            canal_semanal = guild.get_channel(CANAL_LEADERBOARD_SEMANAL)
-            if canal_semanal:
-                print(f"📋 Processando canal semanal: #{canal_semanal.name} (ID: {canal_semanal.id})")
-                
-                # Verificar permissões
-                permissões = canal_semanal.permissions_for(guild.me)
-                print(f"🔐 Permissões no canal semanal: Enviar={permissões.send_messages}, Ler={permissões.read_messages}, Gerir={permissões.manage_messages}")
-                
-                if not permissões.send_messages:
-                    print(f"❌ Bot sem permissão para enviar mensagens em #{canal_semanal.name}")
-                else:
-                    # Criar embed semanal
-                    try:
-                        embed_semanal = await criar_embed_leaderboard_completo(dados, "semanal", fake_interaction)
-                        print("✅ Embed semanal criado com sucesso")
-                    except Exception as e:
-                        print(f"❌ Erro ao criar embed semanal: {e}")
-                        embed_semanal = None
-                    
-                    if embed_semanal:
-                        # Limpar mensagens antigas
-                        try:
-                            deleted_count = 0
-                            async for message in canal_semanal.history(limit=10):
-                                if message.author == guild.me:
-                                    try:
-                                        await message.delete()
-                                        deleted_count += 1
-                                        print(f"🗑️ Mensagem antiga apagada: {message.id}")
-                                        await asyncio.sleep(0.5)
-                                    except Exception as e:
-                                        print(f"⚠️ Erro ao apagar mensagem {message.id}: {e}")
-                            if deleted_count > 0:
-                                print(f"✅ {deleted_count} mensagens antigas apagadas")
-                        except Exception as e:
-                            print(f"⚠️ Erro ao limpar mensagens: {e}")
-
-                        # Enviar nova mensagem
-                        try:
-                            mensagem_enviada = await canal_semanal.send(embed=embed_semanal)
-                            print(f"✅ Leaderboard semanal ENVIADA COM SUCESSO! Mensagem ID: {mensagem_enviada.id}")
-                        except discord.Forbidden:
-                            print(f"❌ ERRO DE PERMISSÃO: Bot não pode enviar mensagens em #{canal_semanal.name}")
-                        except discord.HTTPException as e:
-                            print(f"❌ ERRO HTTP ao enviar: {e}")
-                        except Exception as e:
-                            print(f"❌ Erro inesperado ao enviar: {e}")
-            else:
-                print(f"❌ Canal semanal não encontrado (ID: {CANAL_LEADERBOARD_SEMANAL})")
-        else:
-            print("❌ ID do canal semanal não configurado")
-
-        # ATUALIZAR LEADERBOARD MENSAL
-        if CANAL_LEADERBOARD_MENSAL:
-            canal_mensal = guild.get_channel(CANAL_LEADERBOARD_MENSAL)
-            if canal_mensal:
-                print(f"📋 Processando canal mensal: #{canal_mensal.name} (ID: {canal_mensal.id})")
-                
-                # Verificar permissões
-                permissões = canal_mensal.permissions_for(guild.me)
-                print(f"🔐 Permissões no canal mensal: Enviar={permissões.send_messages}")
-                
-                if not permissões.send_messages:
-                    print(f"❌ Bot sem permissão para enviar mensagens em #{canal_mensal.name}")
-                else:
-                    # Criar embed mensal
-                    try:
-                        embed_mensal = await criar_embed_leaderboard_completo(dados, "mensal", fake_interaction)
-                        print("✅ Embed mensal criado com sucesso")
-                    except Exception as e:
-                        print(f"❌ Erro ao criar embed mensal: {e}")
-                        embed_mensal = None
-                    
-                    if embed_mensal:
-                        # Limpar mensagens antigas
-                        try:
-                            deleted_count = 0
-                            async for message in canal_mensal.history(limit=10):
-                                if message.author == guild.me:
-                                    try:
-                                        await message.delete()
-                                        deleted_count += 1
-                                        await asyncio.sleep(0.5)
-                                    except:
-                                        pass
-                            if deleted_count > 0:
-                                print(f"✅ {deleted_count} mensagens mensais apagadas")
-                        except:
-                            pass
-
-                        # Enviar nova mensagem
-                        try:
-                            mensagem_enviada = await canal_mensal.send(embed=embed_mensal)
-                            print(f"✅ Leaderboard mensal ENVIADA COM SUCESSO! Mensagem ID: {mensagem_enviada.id}")
-                        except Exception as e:
-                            print(f"❌ Erro ao enviar leaderboard mensal: {e}")
-            else:
-                print(f"❌ Canal mensal não encontrado (ID: {CANAL_LEADERBOARD_MENSAL})")
-        else:
-            print("❌ ID do canal mensal não configurado")
+        # ATUALIZAR LEADERBOARDS (edição da mensagem existente)
+        await publicar_leaderboard(guild, CANAL_LEADERBOARD_SEMANAL, "semanal", dados, fake_interaction)
+        await publicar_leaderboard(guild, CANAL_LEADERBOARD_MENSAL, "mensal", dados, fake_interaction)
                 
         print(f"🎯 Atualização de leaderboards concluída para {guild.name}")
         
@@ -638,90 +2389,298 @@ async def atualizar_leaderboards_automaticamente(guild: discord.Guild):
         import traceback
         traceback.print_exc()
 
+# --- Correspondência de nomes dos arquivados ---
+def normalizar_texto_nome(texto: str) -> str:
+    """Minúsculas, sem acentos e com separadores (-, _ e espaços repetidos) unificados"""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(caractere for caractere in texto if not unicodedata.combining(caractere))
+    return " ".join(texto.replace("-", " ").replace("_", " ").split())
+
+def trigramas(texto: str) -> Set[str]:
+    """Trigramas (sem preenchimento) de um texto normalizado"""
+    return {texto[posicao:posicao + 3] for posicao in range(len(texto) - 2)}
+
+class IndiceNomesUsuarios:
+    """Índice de trigramas dos nomes conhecidos de cada usuário, com totais e IDs dos registros (uma passada)"""
+
+    def __init__(self, registros: List[Dict[str, Any]], guild: discord.Guild = None):
+        self.totais: Dict[Any, float] = {}
+        self.ids: Dict[Any, List[str]] = {}
+        self.nomes: Dict[str, Set[Any]] = {}         # nome normalizado -> chaves de usuário
+        self.trigramas: Dict[str, Set[str]] = {}     # trigrama -> nomes normalizados que o contêm
+        
+        pares = set()
+        for registro in registros:
+            chave = chave_usuario(registro)
+            self.totais[chave] = self.totais.get(chave, 0.0) + float(registro["horas"])
+            self.ids.setdefault(chave, []).append(registro["id"])
+            pares.add((registro["nome"], chave))
+        
+        # Nome gravado e nome de exibição atual de cada usuário (uma consulta por nome, não por registro)
+        for nome, chave in pares:
+            self.indexar(nome, chave)
+            self.indexar(obter_nome_amigavel(nome, guild), chave)
+        for chave in self.totais:
+            if isinstance(chave, int):
+                self.indexar(obter_nome_amigavel(chave, guild), chave)
+
+    def indexar(self, nome: str, chave):
+        """Adiciona um nome conhecido do usuário ao índice"""
+        normalizado = normalizar_texto_nome(nome)
+        if not normalizado:
+            return
+        self.nomes.setdefault(normalizado, set()).add(chave)
+        for trigrama in trigramas(normalizado):
+            self.trigramas.setdefault(trigrama, set()).add(normalizado)
+
+    def corresponder(self, nome: str):
+        """Chave do usuário com horas cujo nome contém (ou está contido em) o nome buscado; None se não houver"""
+        consulta = normalizar_texto_nome(nome)
+        if not consulta:
+            return None
+        
+        # Nomes contidos na consulta: cada trecho da consulta é buscado direto no índice
+        candidatos = {
+            consulta[inicio:fim]
+            for inicio in range(len(consulta)) for fim in range(inicio + 1, len(consulta) + 1)
+            if consulta[inicio:fim] in self.nomes
+        }
+        
+        # Nomes que contêm a consulta: têm todos os trigramas dela (interseção, menor lista primeiro)
+        if len(consulta) < 3:
+            candidatos.update(candidato for candidato in self.nomes if consulta in candidato)
+        else:
+            listas = sorted((self.trigramas.get(trigrama, set()) for trigrama in trigramas(consulta)), key=len)
+            candidatos.update(set.intersection(*listas))
+        
+        # Igualdade vence continência; depois o nome de tamanho mais próximo
+        melhor = None
+        for candidato in candidatos:
+            if candidato == consulta:
+                prioridade = 0
+            elif consulta in candidato or candidato in consulta:
+                prioridade = 1
+            else:
+                continue
+            for chave in self.nomes[candidato]:
+                if self.totais.get(chave, 0.0) <= 0:
+                    continue
+                ordem = (prioridade, abs(len(candidato) - len(consulta)), str(chave))
+                if melhor is None or ordem < melhor[0]:
+                    melhor = (ordem, chave)
+        return melhor[1] if melhor else None
+
+def nomes_dos_canais_arquivados(canais: List[discord.TextChannel]) -> Set[str]:
+    """Nomes de usuários derivados dos nomes dos canais arquivados (ignorando canais de sistema)"""
+    palavras_ignorar = ["arquivado", "archive", "geral", "general", "chat", "categoria", "category"]
+    nomes = set()
+    for canal in canais:
+        nome_canal = canal.name.lower()
+        if any(palavra in nome_canal for palavra in palavras_ignorar):
+            continue
+        nome_limpo = nome_canal.replace("-", " ").replace("_", " ").replace("arquivada", "").replace("archived", "").strip()
+        if nome_limpo and len(nome_limpo) > 2:  # Evitar nomes muito curtos
+            nomes.add(nome_limpo.title())
+    return nomes
+
+def planejar_reset_arquivados(dados: Dict[str, Any], nomes_arquivados: Set[str],
+                              guild: discord.Guild = None) -> Tuple[List[Tuple[Any, float]], List[str]]:
+    """Usuários com horas correspondentes aos nomes arquivados (maior total primeiro) e os IDs dos seus registros"""
+    indice = IndiceNomesUsuarios(dados.get("registros", []), guild)
+    chaves = set()
+    for nome in nomes_arquivados:
+        chave = indice.corresponder(nome)
+        if chave is not None:
+            chaves.add(chave)
+    
+    usuarios = sorted(((chave, indice.totais[chave]) for chave in chaves), key=lambda x: x[1], reverse=True)
+    ids = [registro_id for chave in chaves for registro_id in indice.ids[chave]]
+    return usuarios, ids
+
+# Planos de reset das prévias do /arquivados: token -> servidor, usuários, IDs dos registros e validade
+_planos_arquivados: Dict[str, Dict[str, Any]] = {}
+
+def guardar_plano_arquivados(guild_id: int, usuarios: List[Tuple[Any, float]], ids: List[str]) -> str:
+    """Guarda o plano de reset da prévia e retorna o token que o confirma"""
+    token = uuid.uuid4().hex[:8].upper()
+    _planos_arquivados[token] = {
+        "guild_id": guild_id,
+        "usuarios": usuarios,
+        "ids": ids,
+        "expira_em": time.monotonic() + VALIDADE_PLANO_ARQUIVADOS
+    }
+    return token
+
+def retirar_plano_arquivados(guild_id: int, token: str) -> Optional[Dict[str, Any]]:
+    """Remove e retorna o plano do token (None se não existe, venceu ou é de outro servidor)"""
+    agora = time.monotonic()
+    for vencido in [chave for chave, plano in _planos_arquivados.items() if plano["expira_em"] <= agora]:
+        del _planos_arquivados[vencido]
+    
+    token = token.strip().upper()
+    plano = _planos_arquivados.get(token)
+    if plano is None or plano["guild_id"] != guild_id:
+        return None
+    return _planos_arquivados.pop(token)
+
 # --- Classe do bot ---
+def opcoes_gateway() -> Dict[str, Any]:
+    """Intents e políticas de cache do cliente (todas, ou as mínimas no modo enxuto)"""
+    if not BOT_MODO_ENXUTO:
+        return {"intents": discord.Intents.all()}
+    
+    intents = discord.Intents.none()
+    intents.guilds = True           # Canais, categorias e cargos
+    intents.guild_messages = True   # Mensagens do Nyox em tempo real
+    intents.message_content = True  # Embeds de mensagens de outros bots
+    intents.members = True          # Eventos de membros e consultas por ID (cache de nomes)
+    
+    # Sem cache de membros (só o próprio bot): os nomes vêm de CacheNomesMembros
+    return {
+        "intents": intents,
+        "member_cache_flags": discord.MemberCacheFlags.none(),
+        "max_messages": MAX_MENSAGENS_CACHE,
+        "chunk_guilds_at_startup": False
+    }
+
 class ASAE(commands.Bot):
     def __init__(self):
-        intents = discord.Intents.all()
-        super().__init__(command_prefix="!", intents=intents)
+        super().__init__(command_prefix="!", **opcoes_gateway())
         self.config = carregar_configuracoes()  # Configuração global inicial
         self.servidores_verificados = False
         self.dados_processados = False  # Nova flag para controlar se os dados foram processados
+        self.versao_membros = 0  # Incrementa quando nomes de membros mudam (invalida embeds em cache)
+        self.locks_servidores: Dict[int, asyncio.Lock] = {}  # Um processamento por servidor de cada vez
+        self.tarefas_servidores: Dict[Tuple[str, int], asyncio.Task] = {}
+        self.ingestoes_em_andamento: Dict[int, asyncio.Task] = {}
+        self.ultima_ingestao: Dict[int, float] = {}  # guild_id -> loop.time() do fim da última ingestão
+        # Canais lidos por completo nesta sessão do gateway: daí em diante, toda mensagem nova chega por evento
+        self.canais_sincronizados: Set[int] = set()
+        self.cursores_gateway: Dict[int, int] = {}  # canal_id -> maior mensagem vista por evento
+        self.backfills: Dict[int, asyncio.Task] = {}
+        self.progresso_backfill: Dict[int, Dict[str, Any]] = {}
 
     async def setup_hook(self):
+        # Migração única dos arquivos JSON quando o backend SQLite está ativo
+        try:
+            migrados = migrar_json_para_sqlite()
+            if migrados:
+                print(f"✅ {migrados} servidor(es) migrado(s) para SQLite")
+        except Exception as e:
+            print(f"❌ Erro na migração para SQLite: {e}")
+        
+        # Carregar uma única vez os dados de cada servidor para o cache residente
+        for guild_id in ALLOWED_SERVERS:
+            dados = carregar_horas(guild_id)
+            print(f"📥 {len(dados.get('registros', []))} registros carregados em memória ({obter_arquivo_horas(guild_id)})")
+        
+        # Railway encerra o worker com SIGTERM: gravar tudo antes de sair
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(self.close()))
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows não suporta add_signal_handler
+        
         try:
             await self.tree.sync()
             print("✅ Comandos sincronizados com sucesso!")
         except Exception as e:
             print(f"❌ Erro ao sincronizar comandos: {e}")
 
+    async def close(self):
+        """Grava os dados pendentes antes de desconectar"""
+        try:
+            await descarregar_tudo()
+        except Exception as e:
+            print(f"❌ Erro ao gravar dados no desligamento: {e}")
+        await super().close()
+
+    def obter_lock_servidor(self, guild_id: int) -> asyncio.Lock:
+        """Retorna o lock de processamento do servidor"""
+        lock = self.locks_servidores.get(guild_id)
+        if lock is None:
+            lock = self.locks_servidores[guild_id] = asyncio.Lock()
+        return lock
+
+    async def supervisionar(self, nome: str, guild: discord.Guild, trabalho: Callable, timeout: float):
+        """Executa o trabalho de um servidor com lock próprio, timeout e isolamento de erros"""
+        try:
+            async with self.obter_lock_servidor(guild.id):
+                await asyncio.wait_for(trabalho(guild), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"⏱️ {nome} excedeu {timeout}s em {guild.name}, cancelado")
+        except Exception as e:
+            print(f"❌ Erro em {nome} para {guild.name}: {e}")
+
+    async def executar_por_servidor(self, nome: str, trabalho: Callable, timeout: float):
+        """Dispara uma tarefa supervisionada por servidor permitido e aguarda todas"""
+        tarefas = []
+        for guild in self.guilds:
+            if guild.id not in ALLOWED_SERVERS:
+                continue
+            
+            # Não empilhar execuções: se a anterior ainda roda, pular este servidor
+            anterior = self.tarefas_servidores.get((nome, guild.id))
+            if anterior and not anterior.done():
+                print(f"⏭️ {nome} ainda em execução em {guild.name}, pulando")
+                continue
+            
+            tarefa = asyncio.create_task(self.supervisionar(nome, guild, trabalho, timeout), name=f"{nome}:{guild.id}")
+            self.tarefas_servidores[(nome, guild.id)] = tarefa
+            tarefas.append(tarefa)
+        
+        if tarefas:
+            await asyncio.gather(*tarefas, return_exceptions=True)
+
     @tasks.loop(minutes=5)
     async def auto_update(self):
         """Tarefa de atualização automática a cada 5 minutos"""
         if not self.servidores_verificados:
             return
         
-        try:
-            for guild in self.guilds:
-                # Verificar se é servidor permitido
-                if guild.id not in ALLOWED_SERVERS:
-                    continue
-                    
-                # Carregar configurações específicas do servidor
-                server_config = get_server_config(guild.id)
-                CATEGORIA_ID = server_config["CATEGORIA_ID"]
-                
-                print(f"🔄 Processando registros em {guild.name}...")
-                dados = await self.processar_categoria(guild, CATEGORIA_ID, limite=100)
-                
-                if dados:
-                    self.dados_processados = True  # Marcar que os dados foram processados
-                    
-                    # CORREÇÃO: Salvar configuração específica do servidor
-                    config_servidor = carregar_configuracoes(guild.id)
-                    config_servidor["auto_update"]["ultima_atualizacao"] = dt.datetime.now().isoformat()
-                    salvar_configuracoes(config_servidor, guild.id)
-                    
-                    print(f"✅ Dados processados em {guild.name}")
-                    
-        except Exception as e:
-            print(f"❌ Erro na atualização automática: {e}")
+        await self.executar_por_servidor("auto_update", self.atualizar_servidor, TIMEOUT_AUTO_UPDATE)
+
+    async def atualizar_servidor(self, guild: discord.Guild):
+        """Processa os registros novos de um servidor"""
+        print(f"🔄 Processando registros em {guild.name}...")
+        dados = await self.ingerir(guild, limite=100)
+        
+        if dados:
+            self.dados_processados = True  # Marcar que os dados foram processados
+            
+            # CORREÇÃO: Salvar configuração específica do servidor
+            config_servidor = carregar_configuracoes(guild.id)
+            config_servidor["auto_update"]["ultima_atualizacao"] = dt.datetime.now().isoformat()
+            salvar_configuracoes(config_servidor, guild.id)
+            
+            print(f"✅ Dados processados em {guild.name}")
 
     @tasks.loop(hours=1)
     async def leaderboard_hourly_update(self):
         """Tarefa de atualização horária das leaderboards - VERSÃO MELHORADA"""
-        try:
-            print("⏰ Leaderboard hourly update iniciado")
+        print("⏰ Leaderboard hourly update iniciado")
+        await self.executar_por_servidor("leaderboard_hourly_update", self.atualizar_leaderboards_servidor,
+                                         TIMEOUT_LEADERBOARD_UPDATE)
+        print("✅ Leaderboard hourly update concluído")
+
+    async def atualizar_leaderboards_servidor(self, guild: discord.Guild):
+        """Processa os dados e atualiza as leaderboards de um servidor"""
+        print(f"🏆 Processando leaderboards para {guild.name}...")
         
-            for guild in self.guilds:
-                if guild.id not in ALLOWED_SERVERS:
-                    continue
-                
-                print(f"🏆 Processando leaderboards para {guild.name}...")
-            
-                # **AGUARDAR processamento de dados primeiro**
-                server_config = get_server_config(guild.id)
-                CATEGORIA_ID = server_config["CATEGORIA_ID"]
-            
-                print(f"🔄 Processando dados antes das leaderboards...")
-                dados = await self.processar_categoria(guild, CATEGORIA_ID, limite=100)
-            
-                if dados:
-                    # **AGUARDAR para garantir que os dados estão salvos**
-                    await asyncio.sleep(3)
-                    print(f"✅ Dados processados, iniciando leaderboards...")
-                    await atualizar_leaderboards_automaticamente(guild)
-                    
-                    # CORREÇÃO: Salvar configuração específica do servidor
-                    config_servidor = carregar_configuracoes(guild.id)
-                    config_servidor["leaderboard_update"]["ultima_atualizacao"] = dt.datetime.now().isoformat()
-                    salvar_configuracoes(config_servidor, guild.id)
-                else:
-                    print(f"❌ Não foi possível processar dados para {guild.name}")
-                
-            print("✅ Leaderboard hourly update concluído")
+        # **AGUARDAR processamento de dados primeiro** (os dados já estão gravados ao retornar)
+        print(f"🔄 Processando dados antes das leaderboards...")
+        dados = await self.ingerir(guild, limite=100)
+        
+        if dados:
+            print(f"✅ Dados processados, iniciando leaderboards...")
+            await self.carregar_nomes_membros(guild)
+            await atualizar_leaderboards_automaticamente(guild)
             
-        except Exception as e:
-            print(f"❌ Erro na atualização horária das leaderboards: {e}")
+            # CORREÇÃO: Salvar configuração específica do servidor
+            config_servidor = carregar_configuracoes(guild.id)
+            config_servidor["leaderboard_update"]["ultima_atualizacao"] = dt.datetime.now().isoformat()
+            salvar_configuracoes(config_servidor, guild.id)
+        else:
+            print(f"❌ Não foi possível processar dados para {guild.name}")
 
     @auto_update.before_loop
     async def before_auto_update(self):
@@ -739,6 +2698,30 @@ class ASAE(commands.Bot):
         
         print("⏰ Leaderboard hourly update iniciado - executando a cada 1 hora")
 
+    async def ingerir(self, guild: discord.Guild, limite: int = 1000, frescor: float = FRESCOR_INGESTAO) -> Dict[str, Any]:
+        """Processa a categoria do servidor, juntando-se a uma ingestão em andamento ou recente"""
+        em_andamento = self.ingestoes_em_andamento.get(guild.id)
+        if em_andamento and not em_andamento.done():
+            return await asyncio.shield(em_andamento)
+        
+        loop = asyncio.get_running_loop()
+        ultima = self.ultima_ingestao.get(guild.id)
+        if ultima is not None and loop.time() - ultima < frescor:
+            return carregar_horas(guild.id)
+        
+        async def executar():
+            try:
+                server_config = get_server_config(guild.id)
+                dados = await self.processar_categoria(guild, server_config["CATEGORIA_ID"], limite=limite)
+                self.ultima_ingestao[guild.id] = loop.time()
+                return dados
+            finally:
+                self.ingestoes_em_andamento.pop(guild.id, None)
+        
+        tarefa = self.ingestoes_em_andamento[guild.id] = asyncio.create_task(executar(), name=f"ingestao:{guild.id}")
+        # shield: cancelar quem espera (ex.: timeout de um chamador) não cancela a ingestão dos demais
+        return await asyncio.shield(tarefa)
+
     async def processar_categoria(self, guild: discord.Guild, categoria_id: int, limite: int = 1000) -> Dict[str, Any]:
         """Processa mensagens na categoria especificada"""
         # Verificar se é um servidor permitido
@@ -758,61 +2741,338 @@ class ASAE(commands.Bot):
 
         registros_processados = 0
         mensagens_processadas = set()
-    
-        for canal in categoria.channels:
-            if not isinstance(canal, discord.TextChannel):
-                continue
-            
+        mensagens_importadas = obter_indice_mensagens(dados)
+        cursores = dados.get("cursores", {})
+        novos_cursores = {}
+        mutacoes = []
+        
+        # Cada canal é uma rota própria no limitador do discord.py; o semáforo limita a concorrência
+        semaforo = asyncio.Semaphore(max(1, CANAIS_CONCORRENTES))
+        canais = [canal for canal in categoria.channels if isinstance(canal, discord.TextChannel)]
+        resultados = await asyncio.gather(
+            *(self.ler_canal(canal, self.cursor_canal(canal.id, cursores), limite, semaforo) for canal in canais)
+        )
+        
+        # Mesclar na ordem dos canais para um único commit
+        for canal, (encontrados, novo_cursor) in zip(canais, resultados):
+            for msg_id, data, nome_usuario, tempo_horas in encontrados:
+                if msg_id in mensagens_processadas or msg_id in mensagens_importadas:
+                    continue
+                mensagens_processadas.add(msg_id)
+                mutacoes.append({"op": "adicionar", "registro": criar_registro_mensagem(
+                    msg_id, data, nome_usuario, tempo_horas
+                )})
+                registros_processados += 1
+            if novo_cursor:
+                novos_cursores[str(canal.id)] = novo_cursor
+
+        # Registros novos e cursores vão juntos para o journal
+        if novos_cursores:
+            mutacoes.append({"op": "estado", "chave": "cursores", "valores": novos_cursores})
+        # Dados do servidor guardados uma única vez (não em cada registro)
+        servidor = {"id": guild.id, "nome": guild.name}
+        if dados.get("servidor") != servidor:
+            mutacoes.append({"op": "estado", "chave": "servidor", "valores": servidor})
+        await enfileirar_mutacoes(mutacoes, guild.id)
+        if registros_processados > 0:
+            print(f"📊 Processados {registros_processados} novos registros em {guild.name} (Arquivo: {server_config['HORAS_ARQUIVO']})")
+        
+        return dados
+
+    async def ler_canal(self, canal: discord.TextChannel, cursor: Optional[int], limite: int,
+                        semaforo: asyncio.Semaphore) -> Tuple[List[Tuple[int, str, str, float]], Optional[int]]:
+        """Lê o histórico novo de um canal e retorna (registros do Nyox, novo cursor)"""
+        # Cursor incremental: só buscar mensagens mais novas que a última processada
+        ultima_mensagem_canal = canal.last_message_id
+        if cursor and ultima_mensagem_canal and ultima_mensagem_canal <= cursor:
+            return [], None  # Nada novo no canal, nenhuma chamada REST
+        
+        if cursor:
+            historico = canal.history(limit=limite, after=discord.Object(id=cursor), oldest_first=True)
+        else:
+            historico = canal.history(limit=limite)
+        
+        encontrados = []
+        maior_id = cursor or 0
+        mensagens_lidas = 0
+        async with semaforo:
             try:
-                async for msg in canal.history(limit=limite):
-                    if msg.id in mensagens_processadas:
-                        continue
-                    mensagens_processadas.add(msg.id)
-                
-                    if (msg.author.bot and 
-                        any(nome in msg.author.display_name for nome in NYOX_BOT_NAMES)):
+                async for msg in historico:
+                    mensagens_lidas += 1
+                    maior_id = max(maior_id, msg.id)
                     
-                        nome_usuario, tempo_horas = self.extrair_info_embed(msg)
+                    if self.eh_mensagem_nyox(msg.author):
+                        nome_usuario, tempo_horas = self.extrair_info_embed(msg.embeds)
                         if nome_usuario and tempo_horas is not None and tempo_horas > 0:
                             hoje = msg.created_at.date().strftime("%Y-%m-%d")
-                        
-                            registro_existente = None
-                            for registro in dados.get("registros", []):
-                                if (registro["data"] == hoje and 
-                                    registro["nome"] == nome_usuario and
-                                    registro.get("mensagem_id") == msg.id):
-                                    registro_existente = registro
-                                    break
-                        
-                            if not registro_existente:
-                                dados.setdefault("registros", []).append({
-                                    "data": hoje,
-                                    "nome": nome_usuario,
-                                    "horas": tempo_horas,
-                                    "mensagem_id": msg.id,
-                                    "processado_em": dt.datetime.now().isoformat(),
-                                    "servidor_id": guild.id,  # ← ADICIONAR ID DO SERVIDOR
-                                    "servidor_nome": guild.name
-                                })
-                                registros_processados += 1
+                            encontrados.append((msg.id, hoje, nome_usuario, tempo_horas))
                             
             except discord.Forbidden:
-                continue
+                return [], None
             except Exception as e:
-                continue
+                return [], None
+        
+        self.canais_sincronizados.add(canal.id)
+        # Histórico esgotado: mensagens apagadas podem deixar last_message_id à frente
+        if ultima_mensagem_canal and mensagens_lidas < limite:
+            maior_id = max(maior_id, ultima_mensagem_canal)
+        return encontrados, (maior_id if maior_id and maior_id != cursor else None)
 
-        if registros_processados > 0:
-            salvar_horas(dados, guild.id)  # ← CORREÇÃO AQUI
-            print(f"📊 Processados {registros_processados} novos registros em {guild.name} (Arquivo: {server_config['HORAS_ARQUIVO']})")
+    def iniciar_backfill(self, guild: discord.Guild) -> bool:
+        """Inicia (ou retoma) o backfill do servidor em segundo plano; False se já está rodando"""
+        tarefa = self.backfills.get(guild.id)
+        if tarefa and not tarefa.done():
+            return False
+        self.backfills[guild.id] = asyncio.create_task(self.executar_backfill(guild), name=f"backfill:{guild.id}")
+        return True
+
+    async def executar_backfill(self, guild: discord.Guild):
+        """Importa o histórico completo da categoria, do mais antigo ao mais novo, com checkpoint por canal"""
+        categoria = guild.get_channel(get_server_config(guild.id)["CATEGORIA_ID"])
+        if not isinstance(categoria, discord.CategoryChannel):
+            return
+        canais = [canal for canal in categoria.channels if isinstance(canal, discord.TextChannel)]
         
-        return dados
+        # Marcado como ativo para ser retomado automaticamente após um reinício
+        await enfileirar_mutacoes([{"op": "estado", "chave": "backfill", "valores": {"ativo": True}}], guild.id)
+        progresso = self.progresso_backfill[guild.id] = {
+            "inicio": asyncio.get_running_loop().time(),
+            "mensagens": 0,
+            "registros": 0,
+            "canais": len(canais),
+            "canais_concluidos": 0
+        }
+        print(f"📥 Backfill iniciado em {guild.name}: {len(canais)} canais")
+        
+        try:
+            for canal in canais:
+                await self.backfill_canal(guild, canal, progresso)
+            
+            await enfileirar_mutacoes([{"op": "estado", "chave": "backfill", "valores": {"ativo": False}}], guild.id)
+            print(f"✅ Backfill concluído em {guild.name}: {self.resumo_backfill(progresso)}")
+        except Exception as e:
+            print(f"❌ Erro no backfill de {guild.name} (será retomado do último checkpoint): {e}")
+
+    async def backfill_canal(self, guild: discord.Guild, canal: discord.TextChannel, progresso: Dict[str, Any]):
+        """Percorre o histórico de um canal a partir do checkpoint, gravando a cada lote"""
+        checkpoint = carregar_horas(guild.id).get("backfill", {}).get(str(canal.id)) or {}
+        if checkpoint.get("concluido"):
+            progresso["canais_concluidos"] += 1
+            return
+        
+        ultimo_id = checkpoint.get("ultimo_id")
+        historico = canal.history(limit=None, after=discord.Object(id=ultimo_id) if ultimo_id else None, oldest_first=True)
+        dados = carregar_horas(guild.id)
+        mutacoes = []
+        lidas = 0
+        
+        try:
+            async for msg in historico:
+                lidas += 1
+                ultimo_id = msg.id
+                
+                if self.eh_mensagem_nyox(msg.author) and not mensagem_importada(dados, msg.id):
+                    nome_usuario, tempo_horas = self.extrair_info_embed(msg.embeds)
+                    if nome_usuario and tempo_horas is not None and tempo_horas > 0:
+                        data = msg.created_at.date().strftime("%Y-%m-%d")
+                        mutacoes.append({"op": "adicionar", "registro": criar_registro_mensagem(
+                            msg.id, data, nome_usuario, tempo_horas
+                        )})
+                
+                if lidas >= TAMANHO_LOTE_BACKFILL:
+                    await self.gravar_lote_backfill(guild, canal, mutacoes, lidas, ultimo_id, False, progresso)
+                    dados = carregar_horas(guild.id)
+                    mutacoes = []
+                    lidas = 0
+        except discord.Forbidden:
+            print(f"⚠️ Backfill sem acesso a #{canal.name}, pulando")
+            return
+        
+        await self.gravar_lote_backfill(guild, canal, mutacoes, lidas, ultimo_id, True, progresso)
+        progresso["canais_concluidos"] += 1
+
+    async def gravar_lote_backfill(self, guild: discord.Guild, canal: discord.TextChannel, mutacoes: List[Dict[str, Any]],
+                                   lidas: int, ultimo_id: Optional[int], concluido: bool, progresso: Dict[str, Any]):
+        """Grava os registros do lote junto com o checkpoint do canal e reporta a vazão"""
+        checkpoint = {"ultimo_id": ultimo_id, "concluido": concluido}
+        mutacoes = mutacoes + [{"op": "estado", "chave": "backfill", "valores": {str(canal.id): checkpoint}}]
+        await enfileirar_mutacoes(mutacoes, guild.id)
+        
+        progresso["mensagens"] += lidas
+        progresso["registros"] += len(mutacoes) - 1
+        print(f"📥 Backfill #{canal.name} em {guild.name}: {self.resumo_backfill(progresso)}")
+
+    def resumo_backfill(self, progresso: Dict[str, Any]) -> str:
+        """Texto com o andamento e a vazão do backfill"""
+        decorrido = max(asyncio.get_running_loop().time() - progresso["inicio"], 1e-6)
+        return (f"{progresso['canais_concluidos']}/{progresso['canais']} canais, "
+                f"{progresso['mensagens']} mensagens ({progresso['mensagens'] / decorrido:.0f}/s), "
+                f"{progresso['registros']} registros ({progresso['registros'] / decorrido:.1f}/s)")
+
+    async def carregar_nomes_membros(self, guild: discord.Guild, ids: List[int] = None):
+        """Preenche o cache de nomes consultando no gateway, em lotes, só os IDs presentes nos registros"""
+        if ids is None:
+            usuarios = obter_store(guild.id).obter_indices_usuarios().usuarios
+            ids = [usuario for usuario in usuarios if isinstance(usuario, int)]
+        pendentes = _nomes_membros.pendentes(guild.id, ids)
+        if not pendentes:
+            return
+        
+        alterados = 0
+        for inicio in range(0, len(pendentes), LOTE_CONSULTA_MEMBROS):
+            lote = pendentes[inicio:inicio + LOTE_CONSULTA_MEMBROS]
+            try:
+                membros = await guild.query_members(user_ids=lote, limit=len(lote), cache=False)
+            except (asyncio.TimeoutError, discord.ClientException) as e:
+                print(f"⚠️ Falha ao consultar membros de {guild.name}: {e}")
+                break
+            encontrados = {membro.id: membro.display_name for membro in membros}
+            for user_id in lote:
+                # Quem não voltou na consulta saiu do servidor ("" evita consultar de novo até vencer)
+                alterados += _nomes_membros.definir(guild.id, user_id, encontrados.get(user_id, ""))
+        
+        if alterados:
+            self.versao_membros += 1
+            print(f"🪪 {alterados} nome(s) de membros atualizados em {guild.name}")
+
+    async def resolver_apelidos(self, guild: discord.Guild):
+        """Associa os nomes livres dos registros aos IDs dos membros (cada nome é procurado uma vez)"""
+        dados = carregar_horas(guild.id)
+        # Nomes já procurados (em dados["apelidos_consultados"]) só voltam a ser procurados depois de vencidos
+        limite = (dt.date.today() - dt.timedelta(days=DIAS_NOVA_TENTATIVA_APELIDOS)).isoformat()
+        consultados = dados.get("apelidos_consultados", {})
+        pendentes = {
+            normalizar_alias(r["nome"]) for r in dados.get("registros", []) if not r.get("usuario_id")
+        }
+        pendentes = {nome for nome in pendentes if nome and consultados.get(nome, "") < limite}
+        if not pendentes:
+            return
+        
+        if guild.chunked:
+            membros = guild.members
+        elif len(pendentes) <= LIMITE_CONSULTAS_APELIDOS:
+            # Poucos nomes novos: busca por prefixo, sem listar o servidor inteiro
+            membros = []
+            for nome in pendentes:
+                try:
+                    membros.extend(await guild.query_members(query=nome, limit=100, cache=False))
+                except (asyncio.TimeoutError, discord.ClientException) as e:
+                    print(f"⚠️ Falha ao consultar membros de {guild.name}: {e}")
+                    return
+        else:
+            # Muitos nomes (primeira execução): lista completa sob demanda, sem cache
+            membros = await guild.chunk(cache=False)
+        por_nome: Dict[str, Set[int]] = {}
+        for membro in membros:
+            for nome in {membro.display_name, membro.name, membro.global_name}:
+                if nome:
+                    por_nome.setdefault(normalizar_alias(nome), set()).add(membro.id)
+        
+        # Só apelidos sem ambiguidade (um único membro com aquele nome)
+        aliases = {}
+        for nome in pendentes:
+            ids = por_nome.get(nome, set())
+            if len(ids) == 1:
+                aliases[nome] = next(iter(ids))
+        
+        hoje = dt.date.today().isoformat()
+        mutacoes = [{"op": "estado", "chave": "apelidos_consultados", "valores": {nome: hoje for nome in pendentes}}]
+        if aliases:
+            mutacoes.append({"op": "estado", "chave": "aliases", "valores": aliases})
+        for registro in dados.get("registros", []):
+            alias = normalizar_alias(registro["nome"])
+            if not registro.get("usuario_id") and alias in aliases:
+                mutacoes.append({"op": "alterar", "id": registro["id"], "campos": {"usuario_id": aliases[alias]}})
+        if await enfileirar_mutacoes(mutacoes, guild.id) and aliases:
+            print(f"🪪 {len(aliases)} apelido(s) associados a IDs em {guild.name} ({len(mutacoes) - 2} registros)")
+
+    def cursor_canal(self, canal_id: int, cursores: Dict[str, int]) -> Optional[int]:
+        """Cursor do canal, adiantado pelas mensagens recebidas por evento se o canal está sincronizado"""
+        cursor = cursores.get(str(canal_id))
+        if canal_id in self.canais_sincronizados and canal_id in self.cursores_gateway:
+            cursor = max(cursor or 0, self.cursores_gateway[canal_id])
+        return cursor
+
+    def canal_monitorado(self, guild_id: Optional[int], canal) -> bool:
+        """Indica se o canal pertence à categoria de registros de um servidor permitido"""
+        if guild_id not in ALLOWED_SERVERS or canal is None:
+            return False
+        return getattr(canal, "category_id", None) == get_server_config(guild_id)["CATEGORIA_ID"]
+
+    @staticmethod
+    def eh_mensagem_nyox(autor) -> bool:
+        """Indica se o autor é um dos bots do Nyox"""
+        return autor.bot and any(nome in autor.display_name for nome in NYOX_BOT_NAMES)
+
+    async def ingerir_mensagem(self, msg: discord.Message):
+        """Registra em tempo real uma mensagem nova do Nyox"""
+        if not msg.guild or not self.canal_monitorado(msg.guild.id, msg.channel):
+            return
+        
+        if msg.channel.id in self.canais_sincronizados:
+            self.cursores_gateway[msg.channel.id] = max(self.cursores_gateway.get(msg.channel.id, 0), msg.id)
+        
+        if not self.eh_mensagem_nyox(msg.author):
+            return
+        
+        nome_usuario, tempo_horas = self.extrair_info_embed(msg.embeds)
+        if not nome_usuario or tempo_horas is None or tempo_horas <= 0:
+            return
+        if mensagem_importada(carregar_horas(msg.guild.id), msg.id):
+            return
+        
+        data = msg.created_at.date().strftime("%Y-%m-%d")
+        registro = criar_registro_mensagem(msg.id, data, nome_usuario, tempo_horas)
+        if await enfileirar_mutacoes([{"op": "adicionar", "registro": registro}], msg.guild.id):
+            print(f"⚡ Registro em tempo real: {nome_usuario} +{tempo_horas:.2f}h em {msg.guild.name}")
+
+    async def ingerir_edicao(self, payload: discord.RawMessageUpdateEvent):
+        """Atualiza ou retira o registro de uma mensagem do Nyox editada"""
+        if "embeds" not in payload.data:
+            return  # Edição sem mudança nos embeds
+        guild = self.get_guild(payload.guild_id) if payload.guild_id else None
+        if not guild or not self.canal_monitorado(guild.id, guild.get_channel(payload.channel_id)):
+            return
+        
+        embeds = [discord.Embed.from_dict(embed) for embed in payload.data["embeds"]]
+        nome_usuario, tempo_horas = self.extrair_info_embed(embeds)
+        valido = bool(nome_usuario) and tempo_horas is not None and tempo_horas > 0
+        
+        dados = carregar_horas(guild.id)
+        if mensagem_importada(dados, payload.message_id):
+            if valido:
+                # O usuario_id acompanha o novo nome (None se ele não for resolvível)
+                usuario_id = resolver_usuario_id(dados, nome_usuario)
+                mutacao = {"op": "alterar", "id": f"m{payload.message_id}",
+                           "campos": {"nome": nome_usuario, "horas": tempo_horas, "usuario_id": usuario_id}}
+            else:
+                mutacao = {"op": "remover", "ids": [f"m{payload.message_id}"]}
+            await enfileirar_mutacoes([mutacao], guild.id)
+            return
+        
+        # Mensagem ainda não importada: só registrar se soubermos que o autor é o Nyox
+        mensagem = getattr(payload, "message", None) or payload.cached_message
+        if valido and mensagem and self.eh_mensagem_nyox(mensagem.author):
+            data = discord.utils.snowflake_time(payload.message_id).date().strftime("%Y-%m-%d")
+            registro = criar_registro_mensagem(payload.message_id, data, nome_usuario, tempo_horas)
+            await enfileirar_mutacoes([{"op": "adicionar", "registro": registro}], guild.id)
+
+    async def ingerir_remocao(self, guild_id: Optional[int], mensagens_ids):
+        """Retira os registros de mensagens do Nyox apagadas"""
+        if guild_id not in ALLOWED_SERVERS:
+            return
+        dados = carregar_horas(guild_id)
+        ids = [f"m{mensagem_id}" for mensagem_id in mensagens_ids if mensagem_importada(dados, mensagem_id)]
+        if ids:
+            await enfileirar_mutacoes([{"op": "remover", "ids": ids}], guild_id)
+            print(f"🗑️ {len(ids)} registro(s) retirado(s) por mensagem apagada")
 
-    def extrair_info_embed(self, msg: discord.Message) -> Tuple[Optional[str], Optional[float]]:
-        """Extrai usuário e tempo de mensagens do Nyox"""
-        if not msg.embeds:
+    def extrair_info_embed(self, embeds: List[discord.Embed]) -> Tuple[Optional[str], Optional[float]]:
+        """Extrai usuário e tempo dos embeds de uma mensagem do Nyox"""
+        if not embeds:
             return None, None
 
-        for embed in msg.embeds:
+        for embed in embeds:
             nome_usuario = None
             tempo_horas = 0.0
             
@@ -1092,9 +3352,8 @@ async def atualizar(interaction: discord.Interaction):
     try:
         # Carregar configurações específicas do servidor
         server_config = get_server_config(interaction.guild.id)
-        CATEGORIA_ID = server_config["CATEGORIA_ID"]
         
-        dados = await bot.processar_categoria(interaction.guild, CATEGORIA_ID)
+        dados = await bot.ingerir(interaction.guild)
         total_registros = len(dados.get("registros", []))
         
         ranking = agrupar_horas_por_usuario(dados, dias=365)
@@ -1118,6 +3377,39 @@ async def atualizar(interaction: discord.Interaction):
         )
         await interaction.followup.send(embed=embed, ephemeral=True)
 
+@bot.tree.command(name="backfill", description="Importa todo o histórico da categoria de pontos (retomável)")
+@app_commands.describe(reiniciar="Descartar os checkpoints e recomeçar do início")
+@verificar_servidor_permitido()
+async def backfill(interaction: discord.Interaction, reiniciar: bool = False):
+    """Inicia, retoma ou mostra o andamento do backfill"""
+    if not await verificar_permissao(interaction, "admin"):
+        await interaction.response.send_message("❌ Sem permissão.", ephemeral=True)
+        return
+    
+    tarefa = bot.backfills.get(interaction.guild.id)
+    if tarefa and not tarefa.done():
+        progresso = bot.progresso_backfill[interaction.guild.id]
+        embed = discord.Embed(
+            title="📥 Backfill em andamento",
+            description=bot.resumo_backfill(progresso),
+            color=discord.Color.blue()
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+        return
+    
+    if reiniciar:
+        checkpoints = {chave: {} for chave in carregar_horas(interaction.guild.id).get("backfill", {}) if chave != "ativo"}
+        await enfileirar_mutacoes([{"op": "estado", "chave": "backfill", "valores": checkpoints}], interaction.guild.id)
+    
+    bot.iniciar_backfill(interaction.guild)
+    embed = discord.Embed(
+        title="📥 Backfill iniciado",
+        description="O histórico completo está sendo importado em segundo plano, do mais antigo ao mais novo.\n"
+                    "Use `/backfill` novamente para ver o andamento.",
+        color=discord.Color.green()
+    )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
 @bot.tree.command(name="atualizar_leaderboards", description="Força a atualização das leaderboards automáticas")
 @verificar_servidor_permitido()
 async def atualizar_leaderboards(interaction: discord.Interaction):
@@ -1167,44 +3459,44 @@ async def adicionar_horas(interaction: discord.Interaction, usuario: str, horas:
     else:
         data = dt.datetime.now().date().strftime("%Y-%m-%d")
 
+    # A consulta do nome do membro pode passar do prazo de 3s da primeira resposta.
+    # Resposta adiada efêmera: erros ficam só para quem usou o comando; o sucesso é publicado no canal
+    await interaction.response.defer(ephemeral=True, thinking=True)
+
     # CORREÇÃO: Carregar dados do servidor específico
     dados = carregar_horas(interaction.guild.id)
     
     # Normalizar identificador do usuário
-    if usuario.startswith('<@') and usuario.endswith('>'):
-        usuario_id = usuario[2:-1]
-        try:
-            member = await interaction.guild.fetch_member(int(usuario_id))
-            nome_usuario = member.display_name
-            identificador = usuario
-        except:
-            nome_usuario = f"Usuário {usuario_id}"
-            identificador = usuario
+    if usuario.startswith('<@') and usuario.endswith('>') and usuario[2:-1].isdigit():
+        usuario_id = int(usuario[2:-1])
+        await bot.carregar_nomes_membros(interaction.guild, [usuario_id])
+        nome_usuario = obter_nome_membro(interaction.guild, usuario_id)
+        identificador = usuario
     else:
         if usuario.isdigit() and len(usuario) > 10:
-            try:
-                member = await interaction.guild.fetch_member(int(usuario))
-                nome_usuario = member.display_name
-                identificador = f"<@{usuario}>"
-            except:
-                nome_usuario = f"Usuário {usuario}"
-                identificador = usuario
+            await bot.carregar_nomes_membros(interaction.guild, [int(usuario)])
+            nome_usuario = obter_nome_membro(interaction.guild, int(usuario))
+            identificador = f"<@{usuario}>"
         else:
             nome_usuario = usuario
             identificador = usuario
 
     # Adicionar registro
-    dados.setdefault("registros", []).append({
+    registro = {
         "data": data,
         "nome": identificador,
         "horas": horas,
         "adicionado_manual": True,
         "adicionado_por": interaction.user.display_name,
         "adicionado_em": dt.datetime.now().isoformat()
-    })
+    }
+    registro["id"] = gerar_id_registro(registro)
+    usuario_id = resolver_usuario(dados, identificador)
+    if isinstance(usuario_id, int):
+        registro["usuario_id"] = usuario_id
 
     # CORREÇÃO: Salvar no arquivo específico do servidor
-    if salvar_horas(dados, interaction.guild.id):
+    if await enfileirar_mutacoes([{"op": "adicionar", "registro": registro}], interaction.guild.id):
         total_atual = calcular_total_horas_usuario(dados, identificador)
         
         embed = discord.Embed(
@@ -1218,9 +3510,10 @@ async def adicionar_horas(interaction: discord.Interaction, usuario: str, horas:
         embed.add_field(name="Total Atual", value=formatar_horas(total_atual), inline=True)
         embed.add_field(name="Adicionado por", value=interaction.user.display_name, inline=True)
         
-        await interaction.response.send_message(embed=embed)
+        await interaction.channel.send(embed=embed)
+        await interaction.delete_original_response()
     else:
-        await interaction.response.send_message("❌ Erro ao salvar as horas.", ephemeral=True)
+        await interaction.followup.send("❌ Erro ao salvar as horas.", ephemeral=True)
 
 @bot.tree.command(name="remover_horas", description="Remove horas de um usuário")
 @app_commands.describe(usuario="Usuário para remover horas", horas="Quantidade de horas a remover", data="Data específica (opcional)")
@@ -1254,55 +3547,20 @@ async def remover_horas(interaction: discord.Interaction, usuario: str, horas: f
         await interaction.response.send_message("❌ Este usuário não possui horas registradas.", ephemeral=True)
         return
 
-    # Filtrar registros do usuário
-    registros_usuario = []
-    outros_registros = []
-    
-    for registro in dados.get("registros", []):
-        if registro["nome"] == identificador:
-            if data is None or registro["data"] == data:
-                registros_usuario.append(registro)
-            else:
-                outros_registros.append(registro)
-        else:
-            outros_registros.append(registro)
-
-    # Ordenar registros por data (mais recente primeiro)
-    registros_usuario.sort(key=lambda x: x["data"], reverse=True)
-    
-    # Remover horas dos registros mais recentes primeiro
-    horas_restantes = horas
-    registros_modificados = []
-    
-    for registro in registros_usuario:
-        if horas_restantes <= 0:
-            outros_registros.append(registro)
-            continue
-            
-        if registro["horas"] > horas_restantes:
-            registro["horas"] -= horas_restantes
-            registro["modificado_em"] = dt.datetime.now().isoformat()
-            registro["modificado_por"] = interaction.user.display_name
-            registro["horas_removidas"] = horas_restantes
-            outros_registros.append(registro)
-            horas_restantes = 0
-        else:
-            horas_restantes -= registro["horas"]
-            registros_modificados.append(registro)
-
-    # Se ainda sobrou horas para remover, mostrar aviso
-    if horas_restantes > 0:
-        await interaction.response.send_message(
-            f"⚠️ Aviso: Foram removidas apenas {formatar_horas(horas - horas_restantes)} "
-            f"(de {formatar_horas(horas)} solicitadas).",
-            ephemeral=True
-        )
+    # Desconto relativo: o escritor o resolve contra o estado do momento em que aplica o lote,
+    # então remoções concorrentes do mesmo usuário não se sobrescrevem
+    desconto = {
+        "op": "descontar",
+        "usuario": resolver_usuario(dados, identificador),
+        "horas": horas,
+        "data": data,
+        "modificado_em": dt.datetime.now().isoformat(),
+        "modificado_por": interaction.user.display_name
+    }
 
-    # Atualizar dados
-    dados["registros"] = outros_registros
-    
     # CORREÇÃO: Salvar no arquivo específico do servidor
-    if salvar_horas(dados, interaction.guild.id):
+    if await enfileirar_mutacoes([desconto], interaction.guild.id):
+        horas_removidas = desconto.get("resultado", {}).get("horas_removidas", 0.0)
         total_depois = calcular_total_horas_usuario(dados, identificador)
         
         embed = discord.Embed(
@@ -1311,11 +3569,19 @@ async def remover_horas(interaction: discord.Interaction, usuario: str, horas: f
             timestamp=dt.datetime.now()
         )
         embed.add_field(name="Usuário", value=obter_nome_amigavel(identificador, interaction.guild), inline=True)
-        embed.add_field(name="Horas Removidas", value=formatar_horas(min(horas, horas - horas_restantes)), inline=True)
-        embed.add_field(name="Total Antes", value=formatar_horas(total_antes), inline=True)
+        embed.add_field(name="Horas Removidas", value=formatar_horas(horas_removidas), inline=True)
+        embed.add_field(name="Total Antes", value=formatar_horas(total_depois + horas_removidas), inline=True)
         embed.add_field(name="Total Depois", value=formatar_horas(total_depois), inline=True)
         embed.add_field(name="Removido por", value=interaction.user.display_name, inline=True)
         
+        # Se sobrou horas para remover, avisar na mesma resposta
+        if horas_removidas < horas:
+            embed.add_field(
+                name="⚠️ Aviso",
+                value=f"Foram removidas apenas {formatar_horas(horas_removidas)} (de {formatar_horas(horas)} solicitadas).",
+                inline=False
+            )
+        
         await interaction.response.send_message(embed=embed)
     else:
         await interaction.response.send_message("❌ Erro ao salvar as alterações.", ephemeral=True)
@@ -1329,28 +3595,16 @@ async def horas_usuario(interaction: discord.Interaction, usuario: discord.Membe
         await interaction.response.send_message("❌ Sem permissão.", ephemeral=True)
         return
     
-    # CORREÇÃO: Carregar dados do servidor específico
+    # Chaves do usuário: o ID e, para registros antigos ainda não resolvidos, o apelido
     dados = carregar_horas(interaction.guild.id)
+    chaves = {usuario.id, resolver_usuario(dados, usuario.display_name)}
     
-    # Identificadores possíveis para o usuário
-    identificadores = [
-        usuario.display_name,
-        f"<@{usuario.id}>",
-        str(usuario.id)
-    ]
-    
-    total_periodo = 0
-    registros_usuario = []
+    # Consultar o índice acumulado do usuário (O(log n), sem varrer os registros)
     data_limite = (dt.datetime.now() - dt.timedelta(days=dias)).date()
+    indices = obter_store(interaction.guild.id).obter_indices_usuarios()
+    total_periodo, total_registros, horas_por_data = indices.resumo(chaves, data_limite)
     
-    for registro in dados.get("registros", []):
-        data_registro = dt.datetime.strptime(registro["data"], "%Y-%m-%d").date()
-        
-        if data_registro >= data_limite and registro["nome"] in identificadores:
-            total_periodo += registro["horas"]
-            registros_usuario.append(registro)
-    
-    if not registros_usuario:
+    if not total_registros:
         await interaction.response.send_message(
             f"⚠️ Não foram encontrados registros para {usuario.mention} nos últimos {dias} dias.",
             ephemeral=True
@@ -1363,13 +3617,6 @@ async def horas_usuario(interaction: discord.Interaction, usuario: discord.Membe
         description=f"**Total: {formatar_horas(total_periodo)}**"
     )
     
-    # Agrupar por data
-    horas_por_data = {}
-    for registro in registros_usuario:
-        if registro["data"] not in horas_por_data:
-            horas_por_data[registro["data"]] = 0
-        horas_por_data[registro["data"]] += registro["horas"]
-    
     # Ordenar por data (mais recente primeiro)
     datas_ordenadas = sorted(horas_por_data.keys(), reverse=True)
     
@@ -1390,7 +3637,7 @@ async def horas_usuario(interaction: discord.Interaction, usuario: discord.Membe
     
     embed.add_field(
         name="📊 Estatísticas",
-        value=f"**Dias com registros:** {len(horas_por_data)}\n**Total de registros:** {len(registros_usuario)}",
+        value=f"**Dias com registros:** {len(horas_por_data)}\n**Total de registros:** {total_registros}",
         inline=True
     )
     
@@ -1432,13 +3679,12 @@ async def resetar_horas(interaction: discord.Interaction, usuario: str, confirma
         return
 
     # Filtrar registros (manter apenas os que NÃO são do usuário)
-    registros_antes = len(dados.get("registros", []))
-    dados["registros"] = [r for r in dados.get("registros", []) if r["nome"] != identificador]
-    registros_depois = len(dados.get("registros", []))
-    registros_removidos = registros_antes - registros_depois
+    chave = resolver_usuario(dados, identificador)
+    ids_removidos = [r["id"] for r in dados.get("registros", []) if chave_usuario(r) == chave]
+    registros_removidos = len(ids_removidos)
 
     # CORREÇÃO: Salvar no arquivo específico do servidor
-    if salvar_horas(dados, interaction.guild.id):
+    if await enfileirar_mutacoes([{"op": "remover", "ids": ids_removidos}], interaction.guild.id):
         embed = discord.Embed(
             title="✅ Horas Resetadas",
             color=discord.Color.red(),
@@ -1455,7 +3701,7 @@ async def resetar_horas(interaction: discord.Interaction, usuario: str, confirma
 
 @bot.tree.command(name="arquivados", description="Verifica a categoria de arquivados e remove TODAS as horas dos usuários")
 @app_commands.checks.has_permissions(administrator=True)
-@app_commands.describe(confirmar="Digite 'CONFIRMAR' para realmente remover TODAS as horas")
+@app_commands.describe(confirmar="Token mostrado na prévia para remover exatamente as horas listadas nela")
 @verificar_servidor_permitido()
 async def arquivados(interaction: discord.Interaction, confirmar: str = None):
     """Verifica a categoria de arquivados e remove TODAS as horas dos usuários"""
@@ -1479,13 +3725,9 @@ async def arquivados(interaction: discord.Interaction, confirmar: str = None):
         dados = carregar_horas(interaction.guild.id)
         
         # Verificar se há confirmação
-        if confirmar != "CONFIRMAR":
-            # PRIMEIRO: Verificar quais canais existem na categoria de arquivados
-            canais_arquivados = []
-            for canal in categoria.channels:
-                if isinstance(canal, discord.TextChannel):
-                    canais_arquivados.append(canal)
-            
+        if not confirmar:
+            # PRIMEIRO: Canais de texto existentes na categoria de arquivados
+            canais_arquivados = [canal for canal in categoria.channels if isinstance(canal, discord.TextChannel)]
             if not canais_arquivados:
                 embed = discord.Embed(
                     title="📂 Categoria de Arquivados",
@@ -1496,21 +3738,7 @@ async def arquivados(interaction: discord.Interaction, confirmar: str = None):
                 return
             
             # SEGUNDO: Identificar usuários pelos NOMES DOS CANAIS
-            usuarios_dos_canais = set()
-            
-            for canal in canais_arquivados:
-                # Extrair nome de usuário do nome do canal (ignorar canais de sistema)
-                nome_canal = canal.name.lower()
-                
-                # Ignorar canais que não parecem ser de usuários específicos
-                palavras_ignorar = ["arquivado", "archive", "geral", "general", "chat", "categoria", "category"]
-                if any(palavra in nome_canal for palavra in palavras_ignorar):
-                    continue
-                
-                # Tentar limpar o nome do canal para extrair o nome do usuário
-                nome_limpo = nome_canal.replace("-", " ").replace("_", " ").replace("arquivada", "").replace("archived", "").strip()
-                if nome_limpo and len(nome_limpo) > 2:  # Evitar nomes muito curtos
-                    usuarios_dos_canais.add(nome_limpo.title())
+            usuarios_dos_canais = nomes_dos_canais_arquivados(canais_arquivados)
             
             # TERCEIRO: Verificar mensagens do Nyox dentro dos canais arquivados
             usuarios_das_mensagens = set()
@@ -1520,7 +3748,7 @@ async def arquivados(interaction: discord.Interaction, confirmar: str = None):
                 try:
                     async for msg in canal.history(limit=50):  # Limitar a 50 mensagens por canal
                         if msg.author.bot and any(nome in msg.author.display_name for nome in NYOX_BOT_NAMES):
-                            nome_usuario, _ = bot.extrair_info_embed(msg)
+                            nome_usuario, _ = bot.extrair_info_embed(msg.embeds)
                             if nome_usuario:
                                 usuarios_das_mensagens.add(nome_usuario)
                                 mensagens_processadas += 1
@@ -1552,35 +3780,9 @@ async def arquivados(interaction: discord.Interaction, confirmar: str = None):
                 await interaction.followup.send(embed=embed, ephemeral=True)
                 return
             
-            # QUARTO: Buscar correspondências nos registros de horas
-            usuarios_com_horas = []
-            total_geral = 0
-            
-            # Primeiro, criar uma lista de todos os nomes únicos nos registros
-            todos_nos_registros = set()
-            for registro in dados.get("registros", []):
-                nome_amigavel = obter_nome_amigavel(registro["nome"], interaction.guild)
-                todos_nos_registros.add((registro["nome"], nome_amigavel))
-            
-            # Agora tentar fazer matching mais inteligente
-            for usuario_arquivado in todos_usuarios_arquivados:
-                # Tentar encontrar correspondência
-                for nome_registro, nome_amigavel in todos_nos_registros:
-                    nome_amigavel_lower = nome_amigavel.lower()
-                    usuario_arquivado_lower = usuario_arquivado.lower()
-                    
-                    # Verificar matching por similaridade (mais tolerante)
-                    if (usuario_arquivado_lower in nome_amigavel_lower or 
-                        nome_amigavel_lower in usuario_arquivado_lower or
-                        usuario_arquivado_lower == nome_amigavel_lower):
-                        
-                        total_horas = calcular_total_horas_usuario(dados, nome_registro)
-                        if total_horas > 0:
-                            # Verificar se já não adicionamos este usuário
-                            if not any(u[0] == nome_registro for u in usuarios_com_horas):
-                                usuarios_com_horas.append((nome_registro, total_horas))
-                                total_geral += total_horas
-                            break
+            # QUARTO: Buscar correspondências no índice de nomes (uma passada pelos registros)
+            usuarios_com_horas, ids_plano = planejar_reset_arquivados(dados, todos_usuarios_arquivados, interaction.guild)
+            total_geral = sum(horas for _, horas in usuarios_com_horas)
             
             if not usuarios_com_horas:
                 embed = discord.Embed(
@@ -1602,8 +3804,8 @@ async def arquivados(interaction: discord.Interaction, confirmar: str = None):
                 await interaction.followup.send(embed=embed, ephemeral=True)
                 return
             
-            # Ordenar por horas (maior primeiro)
-            usuarios_com_horas.sort(key=lambda x: x[1], reverse=True)
+            # Guardar o plano: a confirmação aplica exatamente esta lista, sem reler o Discord
+            token = guardar_plano_arquivados(interaction.guild.id, usuarios_com_horas, ids_plano)
             
             embed = discord.Embed(
                 title="⚠️ CONFIRMAÇÃO REQUERIDA - Reset de Horas",
@@ -1611,7 +3813,7 @@ async def arquivados(interaction: discord.Interaction, confirmar: str = None):
                           f"**Total de horas a serem removidas:** {formatar_horas(total_geral)}\n"
                           f"**Total de usuários afetados:** {len(usuarios_com_horas)}\n\n"
                           f"**⚠️ ESTA AÇÃO É IRREVERSÍVEL!**\n"
-                          f"Para confirmar, use: `/arquivados confirmar: CONFIRMAR`",
+                          f"Para confirmar, use: `/arquivados confirmar: {token}`",
                 color=discord.Color.red()
             )
             
@@ -1629,90 +3831,39 @@ async def arquivados(interaction: discord.Interaction, confirmar: str = None):
                 value=lista_usuarios or "Nenhum usuário encontrado",
                 inline=False
             )
+            embed.set_footer(text=f"Token {token} válido por {VALIDADE_PLANO_ARQUIVADOS // 60} minutos")
             
             await interaction.followup.send(embed=embed, ephemeral=True)
             return
         
         else:
-            # CONFIRMAÇÃO RECEBIDA - EXECUTAR AÇÃO
-            # Repetir o processo de identificação para garantir que estamos resetando os mesmos usuários
-            canais_arquivados = []
-            for canal in categoria.channels:
-                if isinstance(canal, discord.TextChannel):
-                    canais_arquivados.append(canal)
-            
-            if not canais_arquivados:
-                await interaction.followup.send("❌ Nenhum canal encontrado na categoria de arquivados.", ephemeral=True)
-                return
-            
-            # Identificar usuários (mesma lógica do preview)
-            usuarios_dos_canais = set()
-            for canal in canais_arquivados:
-                nome_canal = canal.name.lower()
-                palavras_ignorar = ["arquivado", "archive", "geral", "general", "chat", "categoria", "category"]
-                if any(palavra in nome_canal for palavra in palavras_ignorar):
-                    continue
-                nome_limpo = nome_canal.replace("-", " ").replace("_", " ").replace("arquivada", "").replace("archived", "").strip()
-                if nome_limpo and len(nome_limpo) > 2:
-                    usuarios_dos_canais.add(nome_limpo.title())
-            
-            usuarios_das_mensagens = set()
-            for canal in canais_arquivados[:10]:
-                try:
-                    async for msg in canal.history(limit=50):
-                        if msg.author.bot and any(nome in msg.author.display_name for nome in NYOX_BOT_NAMES):
-                            nome_usuario, _ = bot.extrair_info_embed(msg)
-                            if nome_usuario:
-                                usuarios_das_mensagens.add(nome_usuario)
-                except:
-                    continue
-            
-            todos_usuarios_arquivados = usuarios_dos_canais.union(usuarios_das_mensagens)
-            
-            if not todos_usuarios_arquivados:
-                await interaction.followup.send("❌ Nenhum usuário identificado para reset.", ephemeral=True)
+            # CONFIRMAÇÃO RECEBIDA - aplicar exatamente o plano da prévia (sem reler canais nem histórico)
+            plano = retirar_plano_arquivados(interaction.guild.id, confirmar)
+            if plano is None:
+                await interaction.followup.send(
+                    "❌ Token inválido ou expirado. Use `/arquivados` sem confirmação para gerar uma nova prévia.",
+                    ephemeral=True
+                )
                 return
             
-            # Encontrar correspondências exatas nos registros
-            usuarios_para_resetar = set()
-            todos_nos_registros = set()
-            for registro in dados.get("registros", []):
-                nome_amigavel = obter_nome_amigavel(registro["nome"], interaction.guild)
-                todos_nos_registros.add((registro["nome"], nome_amigavel))
-            
-            for usuario_arquivado in todos_usuarios_arquivados:
-                for nome_registro, nome_amigavel in todos_nos_registros:
-                    nome_amigavel_lower = nome_amigavel.lower()
-                    usuario_arquivado_lower = usuario_arquivado.lower()
-                    
-                    if (usuario_arquivado_lower in nome_amigavel_lower or 
-                        nome_amigavel_lower in usuario_arquivado_lower or
-                        usuario_arquivado_lower == nome_amigavel_lower):
-                        usuarios_para_resetar.add(nome_registro)
-                        break
-            
-            if not usuarios_para_resetar:
-                await interaction.followup.send("❌ Nenhuma correspondência encontrada para reset.", ephemeral=True)
+            # Só os registros do plano que ainda existem (uma passada pelos registros)
+            ids_plano = set(plano["ids"])
+            removidos = [registro for registro in dados.get("registros", []) if registro.get("id") in ids_plano]
+            if not removidos:
+                await interaction.followup.send("❌ Os registros deste plano já foram removidos.", ephemeral=True)
                 return
             
-            # Resetar horas de cada usuário encontrado
-            total_registros_antes = len(dados.get("registros", []))
-            horas_removidas_total = 0
-            usuarios_afetados = []
-            
-            for usuario in usuarios_para_resetar:
-                total_antes = calcular_total_horas_usuario(dados, usuario)
-                if total_antes > 0:
-                    # Remover todos os registros deste usuário
-                    dados["registros"] = [r for r in dados.get("registros", []) if r["nome"] != usuario]
-                    horas_removidas_total += total_antes
-                    usuarios_afetados.append((usuario, total_antes))
-            
-            total_registros_depois = len(dados.get("registros", []))
-            registros_removidos = total_registros_antes - total_registros_depois
+            horas_por_usuario: Dict[Any, float] = {}
+            for registro in removidos:
+                chave = chave_usuario(registro)
+                horas_por_usuario[chave] = horas_por_usuario.get(chave, 0.0) + float(registro["horas"])
+            usuarios_afetados = sorted(horas_por_usuario.items(), key=lambda x: x[1], reverse=True)
+            ids_removidos = [registro["id"] for registro in removidos]
+            horas_removidas_total = sum(horas_por_usuario.values())
+            registros_removidos = len(ids_removidos)
             
             # Salvar as alterações
-            if salvar_horas(dados, interaction.guild.id):
+            if await enfileirar_mutacoes([{"op": "remover", "ids": ids_removidos}], interaction.guild.id):
                 embed = discord.Embed(
                     title="✅ Horas Resetadas com Sucesso",
                     description=f"**Total de horas removidas:** {formatar_horas(horas_removidas_total)}\n"
@@ -1754,18 +3905,6 @@ async def arquivados(interaction: discord.Interaction, confirmar: str = None):
             color=discord.Color.red()
         )
         await interaction.followup.send(embed=embed, ephemeral=True)
-            
-        # Adicionar debug info
-        embed.add_field(
-            name="🔍 Informações de Debug",
-            value=f"Canais na categoria: {len(canais_arquivados)}\n"
-                    f"Usuários identificados: {len(todos_usuarios_arquivados)}\n"
-                    f"Correspondências com horas: {len(usuarios_com_horas)}",
-            inline=False
-        )
-            
-        await interaction.followup.send(embed=embed, ephemeral=True)
-        return
         
         # [RESTANTE DO CÓDIGO PARA EXECUÇÃO DA CONFIRMAÇÃO...]
         # (manter o código existente para a parte de confirmação)
@@ -1809,6 +3948,54 @@ async def debug_arquivados(interaction: discord.Interaction):
     
     await interaction.followup.send(embed=embed, ephemeral=True)
 
+async def autocompletar_backup(interaction: discord.Interaction, atual: str) -> List[app_commands.Choice[str]]:
+    """Sugere os backups do servidor, dos mais recentes aos mais antigos"""
+    return [
+        app_commands.Choice(name=f"{data.strftime('%d/%m/%Y %H:%M:%S')} ({nome})"[:100], value=nome)
+        for nome, data in listar_backups(interaction.guild.id)
+        if atual.lower() in nome.lower()
+    ][:25]
+
+@bot.tree.command(name="restaurar_backup", description="Lista os backups ou restaura um deles")
+@app_commands.checks.has_permissions(administrator=True)
+@app_commands.describe(backup="Backup a restaurar (vazio para apenas listar)")
+@app_commands.autocomplete(backup=autocompletar_backup)
+@verificar_servidor_permitido()
+async def restaurar_backup(interaction: discord.Interaction, backup: Optional[str] = None):
+    """Lista os backups disponíveis ou restaura o escolhido"""
+    await interaction.response.defer(ephemeral=True)
+    guild_id = interaction.guild.id
+    
+    if not backup:
+        backups = listar_backups(guild_id)
+        linhas = [f"• `{nome}` — {data.strftime('%d/%m/%Y %H:%M:%S')}" for nome, data in backups[:20]]
+        embed = discord.Embed(
+            title="🗄️ Backups disponíveis",
+            description="\n".join(linhas) if linhas else "Nenhum backup encontrado.",
+            color=discord.Color.blue()
+        )
+        embed.set_footer(text=f"{len(backups)} backup(s) • Use /restaurar_backup backup:<nome> para restaurar")
+        await interaction.followup.send(embed=embed, ephemeral=True)
+        return
+    
+    try:
+        dados = carregar_backup(backup, guild_id)
+    except Exception as e:
+        await interaction.followup.send(f"❌ Não foi possível ler o backup: {e}", ephemeral=True)
+        return
+    
+    # O escritor do servidor guarda o estado atual em um backup e então o substitui
+    if await salvar_horas(dados, guild_id):
+        embed = discord.Embed(
+            title="✅ Backup Restaurado",
+            description=f"Dados restaurados a partir de `{backup}`.\nO estado anterior foi salvo em um novo backup.",
+            color=discord.Color.green()
+        )
+        embed.add_field(name="Registros", value=len(dados.get("registros", [])), inline=True)
+        await interaction.followup.send(embed=embed, ephemeral=True)
+    else:
+        await interaction.followup.send("❌ Erro ao gravar os dados restaurados.", ephemeral=True)
+
 @bot.tree.command(name="minhas_horas", description="Mostra suas horas trabalhadas")
 @app_commands.describe(dias="Número de dias para visualizar (padrão: 30)")
 @verificar_servidor_permitido()
@@ -1832,28 +4019,16 @@ async def minhas_horas(interaction: discord.Interaction, dias: int = 30):
             )
         return
     
-    # CORREÇÃO: Carregar dados do servidor específico
-    dados = carregar_horas(interaction.guild.id)
-    
     # Tentar encontrar o usuário por diferentes identificadores
-    identificadores = [
-        interaction.user.display_name,
-        f"<@{interaction.user.id}>",
-        str(interaction.user.id)
-    ]
+    dados = carregar_horas(interaction.guild.id)
+    chaves = {interaction.user.id, resolver_usuario(dados, interaction.user.display_name)}
     
-    total_periodo = 0
-    registros_usuario = []
+    # Consultar o índice acumulado do usuário (O(log n), sem varrer os registros)
     data_limite = (dt.datetime.now() - dt.timedelta(days=dias)).date()
+    indices = obter_store(interaction.guild.id).obter_indices_usuarios()
+    total_periodo, total_registros, horas_por_data = indices.resumo(chaves, data_limite)
     
-    for registro in dados.get("registros", []):
-        data_registro = dt.datetime.strptime(registro["data"], "%Y-%m-%d").date()
-        
-        if data_registro >= data_limite and registro["nome"] in identificadores:
-            total_periodo += registro["horas"]
-            registros_usuario.append(registro)
-    
-    if not registros_usuario:
+    if not total_registros:
         await interaction.response.send_message(
             f"⚠️ Não foram encontrados registros para você nos últimos {dias} dias.",
             ephemeral=True
@@ -1866,13 +4041,6 @@ async def minhas_horas(interaction: discord.Interaction, dias: int = 30):
         description=f"**Total: {formatar_horas(total_periodo)}**"
     )
     
-    # Agrupar por data
-    horas_por_data = {}
-    for registro in registros_usuario:
-        if registro["data"] not in horas_por_data:
-            horas_por_data[registro["data"]] = 0
-        horas_por_data[registro["data"]] += registro["horas"]
-    
     # Ordenar por data (mais recente primeiro)
     datas_ordenadas = sorted(horas_por_data.keys(), reverse=True)
     
@@ -1902,20 +4070,74 @@ async def debug(interaction: discord.Interaction):
     embed.add_field(name="📁 Arquivo de horas", value=f"{'✅ Existe' if horas_existe else '❌ Não existe'}: {horas_arquivo}", inline=True)
     embed.add_field(name="📁 Arquivo de config", value=f"{'✅ Existe' if config_existe else '❌ Não existe'}: {config_arquivo}", inline=True)
     embed.add_field(name="📁 Diretório atual", value=os.getcwd(), inline=False)
+    embed.add_field(name="💾 Armazenamento", value=obter_armazenamento().nome, inline=True)
     
     if horas_existe:
         dados = carregar_horas(interaction.guild.id)
         embed.add_field(name="📊 Registros de horas", value=f"{len(dados.get('registros', []))} registros", inline=True)
+        embed.add_field(name="🔢 Versão dos dados", value=str(versao_dados(interaction.guild.id)), inline=True)
     
     embed.add_field(name="🎯 Servidor atual", value=f"{interaction.guild.name} (ID: {interaction.guild.id})", inline=True)
     embed.add_field(name="📋 Arquivo usado", value=horas_arquivo, inline=True)
     
     await interaction.response.send_message(embed=embed, ephemeral=True)
 
+# --- Eventos de membros (alimentam o cache de nomes e invalidam os embeds em cache) ---
+@bot.event
+async def on_member_join(member: discord.Member):
+    _nomes_membros.definir(member.guild.id, member.id, member.display_name)
+    bot.versao_membros += 1
+
+@bot.event
+async def on_raw_member_remove(payload: discord.RawMemberRemoveEvent):
+    # Versão raw: dispara mesmo sem o membro no cache (modo enxuto)
+    _nomes_membros.definir(payload.guild_id, payload.user.id, "")
+    bot.versao_membros += 1
+
+@bot.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    # Só para membros em cache (fora do modo enxuto); no modo enxuto vale a validade do cache de nomes
+    if _nomes_membros.definir(after.guild.id, after.id, after.display_name):
+        bot.versao_membros += 1
+
+@bot.event
+async def on_user_update(before: discord.User, after: discord.User):
+    if before.display_name != after.display_name:
+        # O nome global vale para todos os servidores onde o membro não tem apelido
+        _nomes_membros.expirar_usuario(after.id)
+        for guild in bot.guilds:
+            member = guild.get_member(after.id)
+            if member:
+                _nomes_membros.definir(guild.id, after.id, member.display_name)
+        bot.versao_membros += 1
+
+# --- Ingestão em tempo real das mensagens do Nyox ---
+@bot.listen("on_message")
+async def ingerir_mensagem_nova(message: discord.Message):
+    await bot.ingerir_mensagem(message)
+
+@bot.event
+async def on_raw_message_edit(payload: discord.RawMessageUpdateEvent):
+    await bot.ingerir_edicao(payload)
+
+@bot.event
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    await bot.ingerir_remocao(payload.guild_id, [payload.message_id])
+
+@bot.event
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent):
+    await bot.ingerir_remocao(payload.guild_id, payload.message_ids)
+
 @bot.event
 async def on_ready():
     print(f'✅ Bot conectado como {bot.user}')
+    
+    # Nova sessão do gateway: eventos perdidos na reconexão só o polling recupera
+    bot.canais_sincronizados.clear()
+    bot.cursores_gateway.clear()
     print(f'📁 Diretório atual: {os.getcwd()}')
+    if BOT_MODO_ENXUTO:
+        print(f'🪶 Modo enxuto: intents mínimos, cache de mensagens limitado a {MAX_MENSAGENS_CACHE}')
     
     # Verificar servidores permitidos aqui (quando o bot está realmente pronto)
     servidores_permitidos_encontrados = []
@@ -1937,10 +4159,9 @@ async def on_ready():
             for guild in bot.guilds:
                 if guild.id in ALLOWED_SERVERS:
                     server_config = get_server_config(guild.id)
-                    CATEGORIA_ID = server_config["CATEGORIA_ID"]
                     
                     print(f"📊 Processando {guild.name} (Arquivo: {server_config['HORAS_ARQUIVO']})")
-                    dados = await bot.processar_categoria(guild, CATEGORIA_ID, limite=200)
+                    dados = await bot.ingerir(guild, limite=200)
                     if dados:
                         bot.dados_processados = True
                         print(f"✅ Processamento inicial concluído em {guild.name}")
@@ -1948,6 +4169,21 @@ async def on_ready():
         except Exception as e:
             print(f"❌ Erro no processamento inicial: {e}")
         
+        # Associar nomes livres de registros antigos aos IDs dos membros e carregar os nomes de exibição
+        for guild in bot.guilds:
+            if guild.id in ALLOWED_SERVERS:
+                try:
+                    await bot.resolver_apelidos(guild)
+                    await bot.carregar_nomes_membros(guild)
+                except Exception as e:
+                    print(f"❌ Erro ao resolver membros em {guild.name}: {e}")
+        
+        # Retomar backfills interrompidos por um reinício
+        for guild in bot.guilds:
+            if guild.id in ALLOWED_SERVERS and carregar_horas(guild.id).get("backfill", {}).get("ativo"):
+                print(f"📥 Retomando backfill em {guild.name}")
+                bot.iniciar_backfill(guild)
+        
         # Iniciar tarefas apenas se os dados foram processados
         if bot.dados_processados:
             bot.auto_update.start()